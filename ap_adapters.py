@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+import ap_timestamps, csv, itertools
+
+# source rows read and transformed together; each transform runs over one
+# column of a batch at a time
+batch_size = 10000
+
+adapters = {}
+
+def register(name, columns, na = False, constants = None):
+    """Declare a vendor export format.
+
+    columns maps importer columns (see ap_importer.columns) to a source column
+    index, or to a tuple of the index and the transforms to run in order. A
+    tuple of indexes joins those cells with a space. na strips 'N/A' from every
+    source column first, and constants fills columns that aren't in the file.
+    """
+    adapters[name] = {
+        'columns': {column: spec if isinstance(spec, tuple) else (spec,)
+            for column, spec in columns.items()},
+        'na': na,
+        'constants': constants or {}
+    }
+
+def strip_na(values):
+    return [value.strip('N/A') or None for value in values]
+
+def strip_currency(values):
+    return [value.strip('$') if value else value for value in values]
+
+def timestamp(vendor):
+    def parse(values):
+        return ap_timestamps.parse_column(values, vendor)
+    return parse
+
+def read(name, file):
+    # (row count, {column: values}) batches for file, header skipped
+    adapter = adapters[name]
+    with open(file) as f:
+        reader = csv.reader(f)
+        next(reader)
+        while True:
+            rows = list(itertools.islice(reader, batch_size))
+            if not rows:
+                return
+            yield len(rows), get_columns(adapter, rows)
+
+def get_columns(adapter, rows):
+    columns = {}
+    for column, (source, *transforms) in adapter['columns'].items():
+        if isinstance(source, tuple):
+            values = [' '.join([row[i] for i in source]) for row in rows]
+        else:
+            values = [row[source] for row in rows]
+
+        if adapter['na']:
+            values = strip_na(values)
+        for transform in transforms:
+            values = transform(values)
+        columns[column] = values
+
+    for column, value in adapter['constants'].items():
+        columns[column] = [value] * len(rows)
+
+    return columns
+
+# 2016 exports from ITS, with day, date and time columns and extra zone fields
+register('its_2016', {
+    'ticket': 0,
+    'pay_station': 1,
+    'stall': 2,
+    'license_plate': 3,
+    'purchased_date': (7, timestamp('its')),
+    'expiry_date': (8, timestamp('its')),
+    'payment_type': 9,
+    'transaction_type': 10,
+    'coupon_code': 11,
+    'excess_payment': (12, strip_currency),
+    'change_issued': (13, strip_currency),
+    'refund_ticket': (14, strip_currency),
+    'total_collections': (15, strip_currency),
+    'revenue': (16, strip_currency),
+    'rate_name': (17, strip_currency),
+    'hours_paid': 18,
+    'zone': 22,
+    'new_rate_weekday': 23,
+    'new_revenue_weekday': 24,
+    'new_rate_weekend': 25,
+    'new_revenue_weekend': 26
+}, na=True, constants={'method': 'its'})
+
+register('its', {
+    'ticket': 0,
+    'pay_station': 1,
+    'stall': 2,
+    'license_plate': 3,
+    'purchased_date': (4, timestamp('its')),
+    'expiry_date': (5, timestamp('its')),
+    'payment_type': 6,
+    'transaction_type': 7,
+    'coupon_code': 8,
+    'excess_payment': (9, strip_currency),
+    'change_issued': (10, strip_currency),
+    'refund_ticket': (11, strip_currency),
+    'total_collections': (12, strip_currency),
+    'revenue': (13, strip_currency),
+    'rate_name': 14
+}, na=True, constants={'method': 'its'})
+
+register('app', {
+    'passport_tran': 1,
+    'merchant_tran': 2,
+    'parker_id': 3,
+    'rate_name': 4,
+    'zone': 6,
+    'stall': 7,
+    'purchased_date': (8, timestamp('app')),
+    'expiry_date': (9, timestamp('app')),
+    'conv_revenue': (11, strip_currency),
+    'validation_revenue': (12, strip_currency),
+    'transaction_fee': (13, strip_currency),
+    'revenue': (14, strip_currency), # Net Revenue
+    'payment_type': 15,
+    'card_type': 16
+}, constants={'method': 'app'})
+
+register('ips', {
+    'zone': 2,
+    'pay_station': 5,
+    'stall': 7,
+    'license_plate': 8,
+    'transaction_type': 9,
+    'card_type': 12,
+    'purchased_date': ((0, 1), timestamp('ips')),
+    'expiry_date': (13, timestamp('ips')),
+    'revenue': 22
+}, constants={'method': 'ips'})
@@ -0,0 +1,185 @@
+#!/usr/bin/env python3
+import ap_importer, ap_synthetic, argparse, config, json, os, platform, psycopg2, statistics, subprocess
+from datetime import datetime, timedelta, timezone
+from timeit import default_timer as timer
+
+os.environ.setdefault('APP_SETTINGS', 'config.LocalConfig')
+from api import api, intervals
+
+default_sizes = '50x7,200x7,200x30,1000x30'
+
+endpoints = [
+    '/parking-occupancy',
+    '/parking-occupancy?heatmap=1',
+    '/parking-occupancy?day=monday',
+    '/parking-occupancy?day=week',
+    '/parking-revenue',
+    '/parking-revenue?sum=1',
+    '/parking-revenue?day=week',
+    '/parking-time',
+    '/parking-time?heatmap=1',
+    '/parking-time?day=monday',
+    '/parking-time?day=week'
+]
+
+def main():
+    args = get_args()
+    results = []
+
+    db = None
+    if args.endpoints:
+        db = psycopg2.connect(
+            host=config.Db.host,
+            user=config.Db.user,
+            password=config.Db.pw,
+            dbname=config.Db.name)
+        ap_importer.check_schema(db)
+        # every request has to reach the database
+        api.result_cache = None
+
+    for stalls, days in get_sizes(args.sizes):
+        print('Generating ' + str(stalls) + ' stalls over ' + str(days) + ' days...')
+        results += run_functions(stalls, days, args.seed, args.repeat)
+        if db is not None:
+            results += run_endpoints(db, stalls, days, args.seed, args.repeat)
+
+    report = {
+        'commit': get_commit(),
+        'created': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'seed': args.seed,
+        'repeat': args.repeat,
+        'config': {key: api.app.config.get(key) for key in ('USE_HOURLY_ROLLUP', 'QUERY_CHUNK_SIZE')},
+        'results': results
+    }
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print('Wrote ' + str(len(results)) + ' results to ' + args.output + '\n')
+
+    if args.compare:
+        compare(args.compare, report)
+
+def get_args():
+    arg_parser = argparse.ArgumentParser(description='Benchmark the analytics functions and endpoints.')
+    arg_parser.add_argument('--sizes', default=default_sizes,
+        help='comma separated STALLSxDAYS data sets')
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--repeat', type=int, default=5,
+        help='timed runs per benchmark')
+    arg_parser.add_argument('--endpoints', action='store_true',
+        help='also load each data set into the config.Db database and time the endpoints')
+    arg_parser.add_argument('--output', default='benchmark.json')
+    arg_parser.add_argument('--compare', metavar='BASELINE',
+        help='results JSON from an earlier run to print timings against')
+    return arg_parser.parse_args()
+
+def get_sizes(sizes):
+    return [tuple(int(n) for n in size.split('x')) for size in sizes.split(',')]
+
+def run_functions(stalls, days, seed, repeat):
+    rows = list(ap_synthetic.generate(stalls, days, seed))
+    # the occupancy query selects epoch microseconds (see api.get_epoch_columns)
+    transactions = list(intervals.to_epoch_rows(ap_synthetic.get_transactions(rows)))
+    datetime_range = get_datetime_range(days)
+    # naming the stalls keeps the stall inventory, and so the database, out of it
+    params = {'parking_spaces': ['S' + str(n + 1) for n in range(stalls)]}
+    size = get_size(stalls, days, len(rows))
+
+    squashed = api.get_squashed_transactions(transactions, datetime_range)
+    time_intervals = api.get_time_intervals(datetime_range, True)
+    hours = api.generate_times(datetime_range, timedelta(hours=1), True, False)
+
+    def bucket_occupancy():
+        # format_bucketed_occupancy drops the last boundary, so each run gets its own copy
+        with api.app.test_request_context():
+            api.get_bucketed_occupancy(squashed, list(time_intervals), params)
+
+    def potential_occupancy():
+        for i in range(len(hours) - 1):
+            api.get_potential_occupancy(hours[i], hours[i+1])
+
+    benchmarks = [
+        ('get_squashed_transactions', lambda: api.get_squashed_transactions(transactions, datetime_range)),
+        ('get_bucketed_occupancy', bucket_occupancy),
+        ('get_potential_occupancy', potential_occupancy),
+        ('generate_times', lambda: api.generate_times(datetime_range, timedelta(hours=1), True, False)),
+        ('generate_times parking_day', lambda: api.generate_times(datetime_range, timedelta(hours=1), True, 0))
+    ]
+
+    return [measure(name, size, function, repeat) for name, function in benchmarks]
+
+def run_endpoints(db, stalls, days, seed, repeat):
+    name = ap_synthetic.get_name(stalls, days, seed)
+    print('Loading ' + name + '...')
+    rows = ap_synthetic.load(db, stalls, days, seed)
+    size = get_size(stalls, days, rows)
+
+    datetime_range = get_datetime_range(days)
+    body = json.dumps({
+        'datetime_range': {
+            'start': datetime_range['start'].isoformat(),
+            'end': datetime_range['end'].isoformat()
+        },
+        'parking_spaces': [name + '-' + str(n + 1) for n in range(stalls)]
+    })
+    client = api.app.test_client()
+
+    def request(path):
+        response = client.post(path, data=body, content_type='application/json')
+        if response.status_code != 200:
+            raise RuntimeError(path + ' returned ' + str(response.status_code))
+        response.get_data()
+
+    return [measure('POST ' + path, size, lambda: request(path), repeat) for path in endpoints]
+
+def measure(name, size, function, repeat):
+    function() # warm up
+    times = []
+    for _ in range(repeat):
+        started = timer()
+        function()
+        times.append(timer() - started)
+
+    print('  ' + name + ': ' + format_seconds(statistics.median(times)))
+    return {
+        'name': name,
+        'size': size,
+        'min': min(times),
+        'median': statistics.median(times),
+        'mean': statistics.mean(times)
+    }
+
+def get_size(stalls, days, rows):
+    return {'stalls': stalls, 'days': days, 'rows': rows}
+
+def get_datetime_range(days):
+    start = ap_synthetic.localize(ap_synthetic.default_start)
+    return {'start': start, 'end': start + timedelta(days=days)}
+
+def get_commit():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', 'HEAD'],
+            cwd=os.path.dirname(os.path.abspath(__file__))).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def compare(path, report):
+    with open(path) as f:
+        baseline = json.load(f)
+
+    before = {(result['name'], result['size']['stalls'], result['size']['days']): result['median']
+        for result in baseline['results']}
+    print('Median against ' + str(baseline.get('commit')) + ':')
+    for result in report['results']:
+        key = (result['name'], result['size']['stalls'], result['size']['days'])
+        if key not in before:
+            continue
+        print('  ' + result['name'] + ' ' + str(key[1]) + 'x' + str(key[2]) + ': '
+            + format_seconds(before[key]) + ' -> ' + format_seconds(result['median'])
+            + ' (' + '{:.2f}'.format(result['median'] / before[key]) + 'x)')
+
+def format_seconds(seconds):
+    return '{:.2f}ms'.format(seconds * 1000)
+
+if __name__ == '__main__':
+    main()
@@ -1,7 +1,8 @@
 #!/usr/bin/env python3
-import config, csv, glob, re, psycopg2, pytz
-from datetime import datetime, timezone, time
-from dateutil import parser
+import ap_adapters, ap_manifest, ap_rollup, ap_snapshot, ap_stalls, ap_timestamps, argparse, collections, config, csv, glob, io, itertools, migrate, multiprocessing, os, re, psycopg2, pytz
+from datetime import datetime, timedelta, timezone, time
+from time import sleep
+from timeit import default_timer as timer
 
 ticket = 0
 pay_station = 1
@@ -45,198 +46,335 @@ sunday = 6
 after_hours_start = time(4, 0, tzinfo=timezone.utc) # 12am
 after_hours_end = time(13, 0, tzinfo=timezone.utc) # 9am
 
+columns = ('ticket', 'pay_station', 'stall', 'license_plate', 'purchased_date',
+    'expiry_date', 'payment_type', 'transaction_type', 'coupon_code',
+    'excess_payment', 'change_issued', 'refund_ticket', 'total_collections',
+    'revenue', 'rate_name', 'hours_paid', 'zone', 'new_rate_weekday',
+    'new_revenue_weekday', 'new_rate_weekend', 'new_revenue_weekend',
+    'passport_tran', 'merchant_tran', 'parker_id', 'conv_revenue',
+    'validation_revenue', 'transaction_fee', 'card_type', 'method',
+    'parking_day')
+
+# batches land in a temp table first so rows already loaded can be dropped by
+# the ap_transactions natural key instead of failing the whole COPY
+staging_sql = '''CREATE TEMP TABLE IF NOT EXISTS ap_transactions_staging
+        (LIKE ap_transactions INCLUDING DEFAULTS) ON COMMIT DELETE ROWS'''
+copy_sql = 'COPY ap_transactions_staging (' + ', '.join(columns) + ') FROM STDIN WITH (FORMAT csv)'
+insert_sql = 'INSERT INTO ap_transactions (' + ', '.join(columns) + ') SELECT ' \
+    + ', '.join(columns) + ' FROM ap_transactions_staging ON CONFLICT DO NOTHING'
+# a month has to have its partition before its rows arrive, or they end up in
+# ap_transactions_default (see db/migrations/0001_partition_ap_transactions.sql)
+partitions_sql = '''SELECT create_ap_transactions_partitions(min(purchased_date), max(purchased_date))
+        FROM ap_transactions_staging'''
+# occupancy queries only look back config.Config.MAX_TRANSACTION_DAYS from the
+# start of a range, so longer sessions are cut to it here rather than left out there
+cap_sql = '''UPDATE ap_transactions_staging SET expiry_date = purchased_date + %(length)s
+        WHERE expiry_date > purchased_date + %(length)s'''
+
+class BatchError(Exception):
+    def __init__(self, file, offset, error):
+        super().__init__('Batch starting at row ' + str(offset) + ' of ' + file
+            + ' failed: ' + str(error).strip())
+        self.file = file
+        self.offset = offset
+
 def main():
-    db = psycopg2.connect(
+    args = get_args()
+    db = connect()
+    check_schema(db)
+
+    if args.watch:
+        watch(db, args)
+        return
+
+    load(db, get_sources(args.source or config.Import.sources), args.workers, args.batch_size)
+    publish(db)
+
+def connect():
+    return psycopg2.connect(
         host=config.Db.host,
         user=config.Db.user,
         password=config.Db.pw,
         dbname=config.Db.name)
 
-    parse_2016(db)
-    parse_2017(db)
-    parse_2018(db)
-
-def parse_2016(db):
-    cursor = db.cursor()
-
-    months = ['January', 'February', 'March', 'April', 'May', 'June',
-    'July', 'August', 'September', 'October', 'November', 'December']
-
-    for month in months:
-        print('Parsing ' + month + ' 2016...\n')
-
-        with open ('AP Revenue - ' + month + ' 2016.csv', 'r') as f:
-            reader = csv.reader(f)
-            next(reader)
-            for row in reader:
-                del row[4:7] # delete day, date, time
-                del row[16:19] # delete extra zone fields
-                row = strip_na(row)
-                row[purchased_date] = get_date_time(row[4])
-                row[expiry_date] = get_date_time(row[5])
-                row = strip_currencies(row, 9, 15)
-                row.extend([None] * 7)
-                row.append('its')
-                row.append(get_parking_day(row[purchased_date]))
-
-                cursor.execute("""INSERT INTO ap_transactions
-                        (ticket, pay_station, stall, license_plate,
-                        purchased_date, expiry_date, payment_type,
-                        transaction_type, coupon_code, excess_payment,
-                        change_issued, refund_ticket, total_collections,
-                        revenue, rate_name, hours_paid, zone, new_rate_weekday,
-                        new_revenue_weekday, new_rate_weekend,
-                        new_revenue_weekend, passport_tran, merchant_tran,
-                        parker_id, conv_revenue, validation_revenue,
-                        transaction_fee, card_type, method, parking_day)
-                        VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                        %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                        %s, %s, %s, %s)""",
-                        row)
-
-    db.commit()
-    cursor.close()
-
-def parse_2017(db):
-    parse_app(db, '2017_App_Transaction_Report.csv')
-    parse_ips(db, '2017_IPSGroup_Transaction_Report.csv')
-    parse_its_2017(db, '2017_ITS*.csv')
-
-def parse_2018(db):
-    parse_app(db, '2018_App_Transaction_Report_Jan-April.csv')
-    parse_ips(db, 'IPS_Transactions_Jan-Apr2018.csv')
-    parse_its_2018(db, '2017_ITS*.csv')
-
-def parse_app(db, file):
-    cursor = db.cursor()
-
-    print('Parsing App data for ' + file + '...\n')
-    with open(file) as f:
-        reader = csv.reader(f)
-        next(reader)
-        for row in reader:
-            row = strip_currencies(row, 10, 15)
-            dbRow = [None] * 30
-            dbRow[passport_tran] = row[1]
-            dbRow[merchant_tran] = row[2]
-            dbRow[parker_id] = row[3]
-            dbRow[rate_name] = row[4]
-            dbRow[zone] = row[6]
-            dbRow[stall] = row[7]
-            dbRow[purchased_date] = get_date_time(row[8])
-            dbRow[expiry_date] = get_date_time(row[9])
-            dbRow[conv_revenue] = row[11]
-            dbRow[validation_revenue] = row[12]
-            dbRow[transaction_fee] = row[13]
-            dbRow[revenue] = row[14] # Net Revenue
-            dbRow[payment_type] = row[15]
-            dbRow[card_type] = row[16]
-            dbRow[method] = 'app'
-            dbRow[parking_day] = get_parking_day(dbRow[purchased_date])
-
-            cursor.execute("""INSERT INTO ap_transactions
-                    (ticket, pay_station, stall, license_plate, purchased_date,
-                    expiry_date, payment_type, transaction_type, coupon_code,
-                    excess_payment, change_issued, refund_ticket,
-                    total_collections, revenue, rate_name, hours_paid, zone,
-                    new_rate_weekday, new_revenue_weekday, new_rate_weekend,
-                    new_revenue_weekend, passport_tran, merchant_tran,
-                    parker_id, conv_revenue, validation_revenue,
-                    transaction_fee, card_type, method, parking_day)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                    %s, %s)""",
-                    dbRow)
-
-    db.commit()
-    cursor.close()
-
-def parse_ips(db, file):
-    cursor = db.cursor()
-
-    print('Parsing IPS data for ' + file + '...\n')
-    with open(file) as f:
-        reader = csv.reader(f)
-        next(reader)
-        for row in reader:
-            dbRow = [None] * 30
-            dbRow[zone] = row[2]
-            dbRow[pay_station] = row[5]
-            dbRow[stall] = row[7]
-            dbRow[license_plate] = row[8]
-            dbRow[transaction_type] = row[9]
-            dbRow[card_type] = row[12]
-            dbRow[purchased_date] = get_date_time(row[0] + ' ' + row[1])
-            dbRow[expiry_date] = get_date_time(row[13])
-            dbRow[revenue] = row[22]
-            dbRow[method] = 'ips'
-            dbRow[parking_day] = get_parking_day(dbRow[purchased_date])
-
-            cursor.execute("""INSERT INTO ap_transactions
-                    (ticket, pay_station, stall, license_plate, purchased_date,
-                    expiry_date, payment_type, transaction_type, coupon_code,
-                    excess_payment, change_issued, refund_ticket,
-                    total_collections, revenue, rate_name, hours_paid, zone,
-                    new_rate_weekday, new_revenue_weekday, new_rate_weekend,
-                    new_revenue_weekend, passport_tran, merchant_tran,
-                    parker_id, conv_revenue, validation_revenue,
-                    transaction_fee, card_type, method, parking_day)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                    %s, %s)""",
-                    dbRow)
-
-    db.commit()
-    cursor.close()
-
-def parse_its_2017(db, files):
-    for itsFile in glob.glob(files):
-        parse_its(db, itsFile)
-
-def parse_its_2018(db, file):
-    parse_its(db, 'ITS Transactions 2018.csv')
-
-def parse_its(db, file):
-    cursor = db.cursor()
-    print('Parsing ITS data for ' + file + '...\n')
-    with open (file) as f:
-        reader = csv.reader(f)
-        next(reader)
-        for row in reader:
-            row = strip_currencies(strip_na(row), 9, 14)
-            purchased = get_date_time(row[4])
-            expired = get_date_time(row[5])
-
-            dbRow = [row[0], row[1], row[2], row[3], purchased, expired,
-            row[6], row[7], row[8], row[9], row[10], row[11], row[12],
-            row[13], row[14]]
-            dbRow.extend([None] * 13)
-            dbRow.append('its')
-            dbRow.append(get_parking_day(purchased))
-
-            cursor.execute("""INSERT INTO ap_transactions
-                    (ticket, pay_station, stall, license_plate,
-                    purchased_date, expiry_date, payment_type,
-                    transaction_type, coupon_code, excess_payment,
-                    change_issued, refund_ticket, total_collections,
-                    revenue, rate_name, hours_paid, zone, new_rate_weekday,
-                    new_revenue_weekday, new_rate_weekend,
-                    new_revenue_weekend, passport_tran, merchant_tran,
-                    parker_id, conv_revenue, validation_revenue,
-                    transaction_fee, card_type, method, parking_day)
-                    VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                    %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s,
-                    %s, %s, %s, %s)""",
-                    dbRow)
-
+def check_schema(db):
+    # batches need the partitions and ap_stalls the migrations create, so a
+    # database built from db/*.sql alone is stopped here rather than in every batch
+    pending = migrate.get_pending(db)
+    if pending:
+        print('Migrations ' + ', '.join(version + ' ' + name for version, name, _ in pending)
+            + ' have not been applied; run ./migrate.py first\n')
+        raise SystemExit(1)
+
+def load(db, sources, workers, batch_size):
+    if workers > 1:
+        load_parallel(db, sources, workers, batch_size)
+    else:
+        load_serial(db, sources, batch_size)
+
+def publish(db):
+    # brings the rollup and snapshot up to date with what was loaded and
+    # tells the API, which picks up the new version within CACHE_VERSION_TTL
+    if ap_rollup.refresh(db):
+        # exported before the new version is published, so nothing cached
+        # under it can come from the old snapshot
+        if config.Import.snapshot_path:
+            ap_snapshot.export(db, config.Import.snapshot_path)
+        record_data_version(db)
+
+def watch(db, args):
+    # load files dropped into args.watch, new or appended to, every
+    # args.interval seconds until interrupted
+    patterns = []
+    for pattern in args.source or config.Import.watch_sources:
+        adapter, _, files = pattern.partition(':')
+        patterns.append(adapter + ':' + os.path.join(args.watch, files))
+
+    print('Watching ' + args.watch + ' every ' + str(args.interval) + 's...\n')
+    seen = {}
+    unpublished = False
+    published = None
+
+    while True:
+        sources = []
+        try:
+            if db is None:
+                db = connect()
+
+            sources = get_changed(get_sources(patterns, False), seen, args.settle)
+            if sources:
+                # anything that commits before a failure still has to be published
+                unpublished = True
+                load(db, sources, args.workers, args.batch_size)
+
+            # every publish exports the whole table to the snapshot, so with
+            # one configured new rows go out at most every snapshot_interval
+            if unpublished and (not config.Import.snapshot_path or published is None
+                or timer() - published >= args.snapshot_interval):
+                publish(db)
+                unpublished = False
+                published = timer()
+        except (BatchError, psycopg2.Error, OSError, ValueError) as e:
+            # the manifest keeps what did commit; the rest is retried next time
+            # on a fresh connection, which may be why this failed
+            print(str(e).strip() + '\n')
+            for adapter, file in sources:
+                seen.pop(file, None)
+            if db is not None:
+                db.close()
+                db = None
+
+        sleep(args.interval)
+
+def get_changed(sources, seen, settle):
+    # sources whose size or modification time moved since the last look, once
+    # nothing has written to them for settle seconds so a row still being
+    # written doesn't get loaded half done
+    changed = []
+    now = datetime.now(timezone.utc).timestamp()
+
+    for adapter, file in sources:
+        try:
+            stat = os.stat(file)
+        except OSError:
+            continue
+
+        if now - stat.st_mtime < settle:
+            continue
+        if seen.get(file) != (stat.st_size, stat.st_mtime_ns):
+            seen[file] = (stat.st_size, stat.st_mtime_ns)
+            changed.append((adapter, file))
+
+    return changed
+
+def record_data_version(db):
+    with db.cursor() as cursor:
+        cursor.execute('INSERT INTO ap_data_version DEFAULT VALUES RETURNING version')
+        version = cursor.fetchone()[0]
     db.commit()
-    cursor.close()
-
-def get_date_time(val):
-    if val:
-        val = pytz.timezone('America/New_York').localize(parser.parse(val, ignoretz=True))
-
-    return val
+    print('Recorded data version ' + str(version) + '\n')
+
+def get_args():
+    arg_parser = argparse.ArgumentParser(description='Import AP transactions.')
+    arg_parser.add_argument('--batch-size', type=int, default=config.Import.batch_size,
+        help='rows sent per COPY batch')
+    arg_parser.add_argument('--workers', type=int, default=1,
+        help='processes used to parse files (1 parses in this process)')
+    arg_parser.add_argument('--source', action='append', metavar='ADAPTER:GLOB',
+        help='files to load with an adapter from ap_adapters.py, in order; '
+            + 'repeatable, replaces config.Import.sources (config.Import.watch_sources '
+            + 'with --watch, where the globs are inside the watched directory)')
+    arg_parser.add_argument('--watch', metavar='DIRECTORY',
+        help='keep running, loading new and appended files from DIRECTORY')
+    arg_parser.add_argument('--interval', type=int, default=config.Import.watch_interval,
+        help='seconds between looks at the --watch directory')
+    arg_parser.add_argument('--settle', type=int, default=config.Import.watch_settle,
+        help='seconds a file has to go unmodified before --watch loads it')
+    arg_parser.add_argument('--snapshot-interval', type=int,
+        default=config.Import.watch_snapshot_interval,
+        help='least seconds between publishing new rows with --watch when a snapshot '
+            + 'is exported, as each export dumps the whole table')
+    return arg_parser.parse_args()
+
+def get_sources(patterns, report_missing = True):
+    # (adapter, file) pairs in the order a serial import loads them, from
+    # ADAPTER:GLOB patterns; each glob's matches load in sorted order
+    sources = []
+    for pattern in patterns:
+        adapter, _, files = pattern.partition(':')
+        if adapter not in ap_adapters.adapters:
+            raise SystemExit('Unknown adapter ' + adapter + ' in ' + pattern + ', expected one of '
+                + ', '.join(sorted(ap_adapters.adapters)))
+
+        matches = sorted(glob.glob(files))
+        if not matches and report_missing:
+            print('No files match ' + files + '\n')
+        sources += [(adapter, file) for file in matches]
+
+    return sources
+
+def get_pending(db, sources):
+    for i, (adapter, file) in enumerate(sources):
+        progress = '(' + str(i + 1) + '/' + str(len(sources)) + ')'
+        offset = ap_manifest.get_offset(db, file)
+        if offset is None:
+            print('Skipping ' + file + ' ' + progress + ', unchanged since last import\n')
+            continue
+
+        yield progress, (adapter, file, offset)
+
+def load_serial(db, sources, batch_size):
+    for progress, (adapter, file, offset) in get_pending(db, sources):
+        print('Parsing ' + file + ' ' + progress + ' from row ' + str(offset) + '...\n')
+        before = ap_timestamps.get_stats()
+        copy_rows(db, read_source(adapter, file), file, batch_size, offset)
+        print_fallbacks(file, before, ap_timestamps.get_stats())
+
+def load_parallel(db, sources, workers, batch_size):
+    # workers parse and encode whole files; this process is the only writer
+    # and takes results in source order, so the table ends up the same as
+    # after a serial run. At most workers + 1 parsed files are held at once.
+    remaining = get_pending(db, sources)
+    pending = collections.deque()
+
+    with multiprocessing.Pool(workers) as pool:
+        for progress, source in itertools.islice(remaining, workers + 1):
+            pending.append((progress, pool.apply_async(parse_file, (source, batch_size))))
+
+        while pending:
+            progress, result = pending.popleft()
+            file, offset, batches, rows, elapsed, timestamps = result.get()
+            print('Parsed ' + file + ' ' + progress + ' from row ' + str(offset) + ': '
+                + '{} rows in {:.1f}s\n'.format(rows, elapsed))
+            print_fallbacks(file, *timestamps)
+
+            for progress, source in itertools.islice(remaining, 1):
+                pending.append((progress, pool.apply_async(parse_file, (source, batch_size))))
+
+            write_batches(db, ((count, io.StringIO(data)) for count, data in batches), file, offset)
+
+def parse_file(source, batch_size):
+    adapter, file, offset = source
+    started = timer()
+    before = ap_timestamps.get_stats()
+    batches = []
+    rows = 0
+
+    for batch in get_batches(itertools.islice(read_source(adapter, file), offset, None), batch_size):
+        batches.append((len(batch), encode_rows(batch).getvalue()))
+        rows += len(batch)
+
+    return file, offset, batches, rows, timer() - started, (before, ap_timestamps.get_stats())
+
+def print_fallbacks(file, before, after):
+    parsed = after['parsed'] - before['parsed']
+    fallback = after['fallback'] - before['fallback']
+    if fallback:
+        print(str(fallback) + ' of ' + str(parsed) + ' timestamps in ' + file
+            + ' needed the dateutil fallback\n')
+
+def read_source(adapter, file):
+    # importer rows for file, put together from the adapter's column batches
+    for count, batch in ap_adapters.read(adapter, file):
+        batch['parking_day'] = [get_parking_day(purchased) for purchased in batch['purchased_date']]
+        empty = [None] * count
+        yield from zip(*[batch.get(column, empty) for column in columns])
+
+def copy_rows(db, rows, file, batch_size, offset = 0):
+    batches = get_batches(itertools.islice(rows, offset, None), batch_size)
+    return write_batches(db, ((len(batch), encode_rows(batch)) for batch in batches), file, offset)
+
+def write_batches(db, batches, file, offset = 0):
+    # stream (row count, CSV data) batches into ap_transactions with COPY,
+    # committing every batch together with the manifest offset so a failed
+    # batch can be retried, or the file resumed, from where it stopped
+    loaded = 0
+    inserted = 0
+    started = timer()
+
+    for count, data in batches:
+        inserted += copy_batch(db, data, file, offset + loaded, count)
+        loaded += count
+
+    ap_manifest.finish(db, file, offset + loaded)
+
+    elapsed = timer() - started
+    rate = loaded / elapsed if elapsed > 0 else 0
+    print('Loaded ' + str(loaded) + ' rows from ' + file + ' in '
+        + '{:.1f}s ({:.0f} rows/s), '.format(elapsed, rate)
+        + str(loaded - inserted) + ' duplicates skipped\n')
+
+    return loaded
+
+def copy_batch(db, data, file, offset, count, retries = None):
+    if retries is None:
+        retries = config.Import.retries
+
+    for attempt in range(retries + 1):
+        data.seek(0)
+        try:
+            with db.cursor() as cursor:
+                cursor.execute(staging_sql)
+                cursor.copy_expert(copy_sql, data)
+                cursor.execute(cap_sql,
+                    {'length': timedelta(days=config.Import.max_transaction_days)})
+                capped = cursor.rowcount
+                cursor.execute(partitions_sql)
+                cursor.execute(insert_sql)
+                inserted = cursor.rowcount
+                ap_stalls.record(cursor)
+                ap_manifest.record_offset(cursor, file, offset + count)
+            db.commit()
+            if capped:
+                print('Cut ' + str(capped) + ' transactions in the batch at row ' + str(offset)
+                    + ' of ' + file + ' to ' + str(config.Import.max_transaction_days) + ' days\n')
+            return inserted
+        except psycopg2.OperationalError as e:
+            if db.closed or attempt == retries:
+                raise BatchError(file, offset, e)
+            db.rollback()
+            print('Retrying batch at row ' + str(offset) + ' of ' + file + '...\n')
+        except psycopg2.Error as e:
+            if not db.closed:
+                db.rollback()
+            raise BatchError(file, offset, e)
+
+def get_batches(rows, batch_size):
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) == batch_size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+def encode_rows(rows):
+    # None and empty cells are both written unquoted, which COPY reads as NULL
+    data = io.StringIO()
+    csv.writer(data).writerows(rows)
+    return data
 
 def strip_letters(val):
     if val:
@@ -244,22 +382,6 @@ def strip_letters(val):
 
     return val
 
-def strip_na(row):
-    row = [val.strip('N/A') for val in row]
-    for i, val in enumerate(row):
-        val = val.strip('N/A')
-        if not val:
-            val = None
-        row[i] = val
-
-    return row
-
-def strip_currencies(row, start, end):
-    for i in range(start, end):
-        row[i] = row[i].strip('$')
-
-    return row
-
 def get_parking_day(purchased_date):
     day = purchased_date.weekday()
 
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+import hashlib, os
+
+chunk_size = 1 << 20
+
+def get_offset(db, file):
+    # first row of file that still needs loading, or None when the file is
+    # unchanged since it was fully imported. Files that only grew resume
+    # where the last import stopped; anything else reloads from row 0 and
+    # relies on the natural key to drop rows already in ap_transactions.
+    size = os.path.getsize(file)
+    with db.cursor() as cursor:
+        cursor.execute("""SELECT file_hash, file_size, row_count, imported_offset
+                FROM import_manifest WHERE file = %s""", (file,))
+        entry = cursor.fetchone()
+
+    file_hash, prefix_hash = hash_file(file, entry[1] if entry else None)
+    offset = 0
+
+    if entry and size >= entry[1] and prefix_hash == entry[0]:
+        if size == entry[1] and entry[2] is not None:
+            return None
+        offset = entry[3]
+
+    with db.cursor() as cursor:
+        cursor.execute("""INSERT INTO import_manifest
+                (file, file_hash, file_size, imported_offset)
+                VALUES (%s, %s, %s, %s)
+                ON CONFLICT (file) DO UPDATE SET
+                file_hash = EXCLUDED.file_hash, file_size = EXCLUDED.file_size,
+                row_count = NULL, imported_offset = EXCLUDED.imported_offset""",
+                (file, file_hash, size, offset))
+    db.commit()
+
+    return offset
+
+def record_offset(cursor, file, offset):
+    # runs inside the batch transaction so the offset never gets ahead of
+    # the rows that were actually committed
+    cursor.execute("""UPDATE import_manifest SET imported_offset = %s
+            WHERE file = %s""", (offset, file))
+
+def finish(db, file, row_count):
+    with db.cursor() as cursor:
+        cursor.execute("""UPDATE import_manifest SET row_count = %s,
+                imported_offset = %s, imported_at = now() WHERE file = %s""",
+                (row_count, row_count, file))
+    db.commit()
+
+def hash_file(file, prefix_size = None):
+    # sha256 of the whole file plus, when prefix_size is given, of its first
+    # prefix_size bytes so appends can be told apart from rewrites
+    full = hashlib.sha256()
+    prefix = None
+    read = 0
+
+    with open(file, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            if prefix_size is not None and prefix is None and read + len(chunk) >= prefix_size:
+                partial = full.copy()
+                partial.update(chunk[:prefix_size - read])
+                prefix = partial.hexdigest()
+
+            full.update(chunk)
+            read += len(chunk)
+
+    if prefix is None and prefix_size == read:
+        prefix = full.hexdigest()
+
+    return full.hexdigest(), prefix
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+
+changed_sql = """SELECT
+        date_trunc('hour', min(purchased_date) AT TIME ZONE 'UTC') AT TIME ZONE 'UTC',
+        (date_trunc('hour', max(greatest(purchased_date, expiry_date)) AT TIME ZONE 'UTC')
+            AT TIME ZONE 'UTC') + interval '1 hour',
+        max(id)
+        FROM ap_transactions WHERE id > %(last_id)s"""
+
+# rows without a stall are rolled up under '', which COPY never stores as a
+# stall (see the natural key), so totals over every stall match the raw rows
+changed_stalls_sql = """SELECT DISTINCT coalesce(stall, '') FROM ap_transactions
+        WHERE id > %(last_id)s"""
+
+delete_sql = """DELETE FROM ap_hourly_rollup
+        WHERE hour >= %(start)s AND hour < %(end)s AND stall = ANY(%(stalls)s)"""
+
+# squashing follows get_squashed_transactions in api/api.py: a transaction
+# starts no earlier than the latest expiry before it and is dropped when it
+# ends inside that expiry
+insert_sql = """INSERT INTO ap_hourly_rollup
+        (stall, hour, occupied_seconds, revenue, transaction_count, paid_seconds)
+        WITH ordered AS (
+            SELECT coalesce(stall, '') AS stall, purchased_date, expiry_date,
+                max(expiry_date) OVER (PARTITION BY stall ORDER BY purchased_date, id
+                    ROWS BETWEEN UNBOUNDED PRECEDING AND 1 PRECEDING) AS previous_end
+            FROM ap_transactions
+            WHERE (stall = ANY(%(stalls)s) OR (stall IS NULL AND '' = ANY(%(stalls)s)))
+                AND expiry_date IS NOT NULL
+                AND expiry_date > %(start)s AND purchased_date < %(end)s
+        ), squashed AS (
+            SELECT stall, greatest(purchased_date, previous_end, %(start)s) AS start_time,
+                least(expiry_date, %(end)s) AS end_time
+            FROM ordered
+            WHERE previous_end IS NULL OR expiry_date > previous_end
+        ), occupancy AS (
+            SELECT stall, hour, sum(extract(epoch FROM
+                least(end_time, hour + interval '1 hour') - greatest(start_time, hour)))
+                AS occupied_seconds
+            FROM squashed, generate_series(
+                date_trunc('hour', start_time AT TIME ZONE 'UTC') AT TIME ZONE 'UTC',
+                end_time - interval '1 microsecond', interval '1 hour') AS hour
+            WHERE end_time > start_time
+            GROUP BY stall, hour
+        ), purchases AS (
+            SELECT coalesce(stall, '') AS stall,
+                date_trunc('hour', purchased_date AT TIME ZONE 'UTC') AT TIME ZONE 'UTC' AS hour,
+                sum(revenue) AS revenue, count(expiry_date) AS transaction_count,
+                coalesce(sum(extract(epoch FROM expiry_date - purchased_date)), 0) AS paid_seconds
+            FROM ap_transactions
+            WHERE (stall = ANY(%(stalls)s) OR (stall IS NULL AND '' = ANY(%(stalls)s)))
+                AND purchased_date >= %(start)s AND purchased_date < %(end)s
+                AND NOT ((purchased_date AT TIME ZONE 'UTC')::time >= '06:00'
+                    AND (purchased_date AT TIME ZONE 'UTC')::time < '13:00')
+            GROUP BY 1, hour
+        )
+        SELECT stall, hour, coalesce(occupancy.occupied_seconds, 0), purchases.revenue,
+            coalesce(purchases.transaction_count, 0), coalesce(purchases.paid_seconds, 0)
+        FROM occupancy FULL JOIN purchases USING (stall, hour)"""
+
+def refresh(db):
+    # rebuild the hours touched by transactions loaded since the last refresh;
+    # returns whether there were any
+    with db.cursor() as cursor:
+        cursor.execute('SELECT last_id FROM ap_hourly_rollup_watermark')
+        row = cursor.fetchone()
+        params = {'last_id': row[0] if row else 0}
+
+        cursor.execute(changed_sql, params)
+        params['start'], params['end'], last_id = cursor.fetchone()
+        if last_id is None:
+            return False
+
+        cursor.execute(changed_stalls_sql, params)
+        params['stalls'] = [stall for stall, in cursor.fetchall()]
+
+        cursor.execute(delete_sql, params)
+        cursor.execute(insert_sql, params)
+        hours = cursor.rowcount
+
+        cursor.execute('DELETE FROM ap_hourly_rollup_watermark')
+        cursor.execute('INSERT INTO ap_hourly_rollup_watermark (last_id) VALUES (%s)', (last_id,))
+
+    db.commit()
+    print('Refreshed ' + str(hours) + ' hourly rollup rows for '
+        + str(len(params['stalls'])) + ' stalls\n')
+
+    return True
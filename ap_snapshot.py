@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+import config, glob, json, numpy as np, os, psycopg2, shutil
+from datetime import datetime, timezone
+
+# one .npy file per column, row i of each is the same transaction. Rows are
+# sorted by stall then purchased_date, so offsets.npy gives each stall's
+# rows as one slice; stall holds indexes into stalls.json
+column_types = (
+    ('stall', np.int32),
+    ('purchased', np.int64), # epoch microseconds
+    ('expiry', np.int64), # epoch microseconds
+    ('revenue', np.int64), # cents
+    ('parking_day', np.int8)
+)
+missing = np.iinfo(np.int64).min
+chunk_size = 65536
+keep = 2 # older snapshots stay around for workers still reading them
+
+export_sql = """SELECT stall,
+        round(extract(epoch FROM purchased_date) * 1000000)::bigint,
+        round(extract(epoch FROM expiry_date) * 1000000)::bigint,
+        (revenue * 100)::bigint, parking_day
+        FROM ap_transactions ORDER BY stall NULLS LAST, purchased_date, id"""
+
+def main():
+    if not config.Import.snapshot_path:
+        raise SystemExit('SNAPSHOT_PATH is not set')
+
+    db = psycopg2.connect(
+        host=config.Db.host,
+        user=config.Db.user,
+        password=config.Db.pw,
+        dbname=config.Db.name)
+
+    export(db, config.Import.snapshot_path)
+
+def export(db, path):
+    # count and rows have to come from the same view of the table
+    with db.cursor() as cursor:
+        cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ')
+        cursor.execute('SELECT count(*) FROM ap_transactions')
+        count = cursor.fetchone()[0]
+
+    if count == 0:
+        db.rollback()
+        return None
+
+    with db.cursor('ap_snapshot_export') as cursor:
+        cursor.itersize = chunk_size
+        cursor.execute(export_sql)
+        directory = write(path, iter(lambda: cursor.fetchmany(chunk_size), []), count)
+
+    db.commit()
+    print('Exported ' + str(count) + ' rows to ' + directory + '\n')
+    return directory
+
+def write(path, chunks, count):
+    # chunks of (stall, purchased, expiry, revenue, parking_day) rows in
+    # snapshot order; becomes path/current once everything is on disk
+    name = 'snapshot-' + datetime.now(timezone.utc).strftime('%Y%m%d%H%M%S%f')
+    building = os.path.join(path, name + '.partial')
+    os.makedirs(building)
+
+    columns = {column: np.lib.format.open_memmap(os.path.join(building, column + '.npy'),
+        mode='w+', dtype=dtype, shape=(count,)) for column, dtype in column_types}
+    stalls = []
+    offsets = []
+    written = 0
+
+    for chunk in chunks:
+        codes = []
+        for row in chunk:
+            if not stalls or row[0] != stalls[-1]:
+                stalls.append(row[0])
+                offsets.append(written + len(codes))
+            codes.append(len(stalls) - 1)
+
+        end = written + len(chunk)
+        columns['stall'][written:end] = codes
+        columns['purchased'][written:end] = [row[1] for row in chunk]
+        columns['expiry'][written:end] = [missing if row[2] is None else row[2] for row in chunk]
+        columns['revenue'][written:end] = [missing if row[3] is None else row[3] for row in chunk]
+        columns['parking_day'][written:end] = [-1 if row[4] is None else row[4] for row in chunk]
+        written = end
+
+    if written != count:
+        raise ValueError('Expected ' + str(count) + ' snapshot rows, got ' + str(written))
+
+    for column in columns.values():
+        column.flush()
+    del columns
+
+    np.save(os.path.join(building, 'offsets.npy'), np.array(offsets + [count], dtype=np.int64))
+    with open(os.path.join(building, 'stalls.json'), 'w') as f:
+        json.dump(stalls, f)
+
+    directory = os.path.join(path, name)
+    os.rename(building, directory)
+    link = os.path.join(path, 'current')
+    if os.path.lexists(link + '.tmp'):
+        os.remove(link + '.tmp')
+    os.symlink(name, link + '.tmp')
+    os.replace(link + '.tmp', link)
+
+    for old in sorted(glob.glob(os.path.join(path, 'snapshot-*')))[:-keep]:
+        shutil.rmtree(old, ignore_errors=True)
+
+    return directory
+
+if __name__ == '__main__':
+    main()
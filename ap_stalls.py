@@ -0,0 +1,19 @@
+#!/usr/bin/env python3
+
+# folds a staged batch into ap_stalls; a stall keeps the last zone it was
+# seen in and the widest purchased_date range across every batch
+record_sql = """INSERT INTO ap_stalls (stall, zone, first_seen, last_seen)
+        SELECT stall,
+        (array_agg(zone ORDER BY purchased_date DESC NULLS LAST) FILTER (WHERE zone IS NOT NULL))[1],
+        min(purchased_date), max(purchased_date)
+        FROM ap_transactions_staging WHERE stall IS NOT NULL
+        GROUP BY stall
+        ON CONFLICT (stall) DO UPDATE SET
+        zone = CASE WHEN EXCLUDED.last_seen >= ap_stalls.last_seen
+            THEN coalesce(EXCLUDED.zone, ap_stalls.zone) ELSE ap_stalls.zone END,
+        first_seen = least(ap_stalls.first_seen, EXCLUDED.first_seen),
+        last_seen = greatest(ap_stalls.last_seen, EXCLUDED.last_seen)"""
+
+def record(cursor):
+    # runs inside the batch transaction, after the COPY into staging
+    cursor.execute(record_sql)
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+import ap_importer, argparse, config, psycopg2, pytz, random
+from datetime import datetime, timedelta
+
+new_york = pytz.timezone('America/New_York')
+default_start = datetime(2018, 3, 5) # a Monday
+
+# rough shape of the real feeds: which vendor a purchase came through, how
+# often people top up before their time runs out, forget to leave an expiry
+# behind or pay during the free overnight hours
+methods = (('its', 0.6), ('app', 0.3), ('ips', 0.1))
+extend_rate = 0.15
+missing_expiry_rate = 0.03
+off_hours_rate = 0.04
+hourly_rate = 1.5
+stalls_per_zone = 50
+
+def generate(stalls, days, seed = 0, start = default_start, prefix = 'S'):
+    # importer rows (see ap_importer.columns) for stalls over days, ordered by
+    # purchased_date the way the occupancy query returns them
+    rng = random.Random(seed)
+    ids = {'ticket': 0, 'passport_tran': 0}
+
+    for day in range(days):
+        date = start + timedelta(days=day)
+        rows = []
+        for n in range(stalls):
+            stall = prefix + str(n + 1)
+            zone = 'Zone ' + str(n // stalls_per_zone + 1)
+            for purchased, expiry in get_sessions(rng, date):
+                rows.append(get_row(rng, ids, stall, zone, purchased, expiry))
+
+        rows.sort(key=lambda row: row[ap_importer.purchased_date])
+        yield from rows
+
+def get_sessions(rng, date):
+    sessions = []
+
+    # enforced hours, 7am to midnight, with a busier middle of the day
+    curr = localize(date + timedelta(hours=7, minutes=rng.uniform(0, 90)))
+    end = localize(date + timedelta(days=1))
+    while curr < end:
+        length = timedelta(minutes=rng.triangular(10, 240, 60))
+        sessions.append((curr, curr + length))
+
+        if rng.random() < extend_rate:
+            # topped up before the last purchase ran out, so they overlap
+            curr = curr + length - timedelta(minutes=rng.uniform(1, 20))
+        else:
+            busy = 1 if 11 <= curr.astimezone(new_york).hour < 19 else 3
+            curr = curr + length + timedelta(minutes=rng.expovariate(1 / (20 * busy)))
+
+    # 2am-9am is free, but some people pay anyway
+    if rng.random() < off_hours_rate:
+        purchased = localize(date + timedelta(hours=rng.uniform(2, 9)))
+        sessions.append((purchased, purchased + timedelta(minutes=rng.triangular(10, 120, 30))))
+
+    return sessions
+
+def get_row(rng, ids, stall, zone, purchased, expiry):
+    row = [None] * 30
+    method = choose(rng, methods)
+    hours = (expiry - purchased).total_seconds() / 3600
+
+    if method == 'app':
+        ids['passport_tran'] += 1
+        row[ap_importer.passport_tran] = ids['passport_tran']
+        row[ap_importer.merchant_tran] = ids['passport_tran']
+    elif method == 'its':
+        ids['ticket'] += 1
+        row[ap_importer.ticket] = ids['ticket']
+
+    row[ap_importer.stall] = stall
+    row[ap_importer.zone] = zone
+    row[ap_importer.purchased_date] = purchased
+    row[ap_importer.expiry_date] = None if rng.random() < missing_expiry_rate else expiry
+    row[ap_importer.hours_paid] = round(hours, 2)
+    row[ap_importer.revenue] = round(hours * hourly_rate, 2)
+    row[ap_importer.method] = method
+    row[ap_importer.parking_day] = ap_importer.get_parking_day(purchased)
+    return row
+
+def choose(rng, weighted):
+    pick = rng.random()
+    for value, weight in weighted:
+        pick -= weight
+        if pick < 0:
+            return value
+    return weighted[-1][0]
+
+def localize(dt):
+    return new_york.localize(dt).astimezone(pytz.utc)
+
+def get_transactions(rows):
+    # (stall, purchased_date, expiry_date) as the API selects them
+    return [(row[ap_importer.stall], row[ap_importer.purchased_date], row[ap_importer.expiry_date])
+        for row in rows]
+
+def get_name(stalls, days, seed):
+    # stands in for the file name in import_manifest and prefixes the stalls,
+    # so several data sets can live side by side
+    return 'synthetic-' + str(stalls) + 'x' + str(days) + '-' + str(seed)
+
+def load(db, stalls, days, seed = 0, start = default_start):
+    name = get_name(stalls, days, seed)
+    rows = generate(stalls, days, seed, start, name + '-')
+    loaded = ap_importer.copy_rows(db, rows, name, config.Import.batch_size)
+    ap_importer.publish(db)
+
+    return loaded
+
+def main():
+    args = get_args()
+    db = psycopg2.connect(
+        host=config.Db.host,
+        user=config.Db.user,
+        password=config.Db.pw,
+        dbname=config.Db.name)
+    ap_importer.check_schema(db)
+
+    start = datetime.strptime(args.start, '%Y-%m-%d')
+    load(db, args.stalls, args.days, args.seed, start)
+
+def get_args():
+    arg_parser = argparse.ArgumentParser(description='Load seeded synthetic AP transactions.')
+    arg_parser.add_argument('--stalls', type=int, default=100)
+    arg_parser.add_argument('--days', type=int, default=7)
+    arg_parser.add_argument('--seed', type=int, default=0)
+    arg_parser.add_argument('--start', default=default_start.strftime('%Y-%m-%d'),
+        help='first day, YYYY-MM-DD in New York time')
+    return arg_parser.parse_args()
+
+if __name__ == '__main__':
+    main()
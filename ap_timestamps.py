@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+import collections, functools, pytz
+from datetime import datetime
+from dateutil import parser
+
+new_york = pytz.timezone('America/New_York')
+
+# layouts seen in each vendor's exports, most common first; the format that
+# last matched is moved to the front so steady files hit on the first try
+formats = {
+    'its': [
+        '%m/%d/%Y %I:%M:%S %p',
+        '%m/%d/%Y %I:%M %p',
+        '%m/%d/%Y %H:%M:%S',
+        '%m/%d/%Y %H:%M',
+        '%Y-%m-%d %H:%M:%S',
+    ],
+    'ips': [
+        '%m/%d/%Y %I:%M:%S %p',
+        '%m/%d/%Y %I:%M %p',
+        '%m/%d/%Y %H:%M:%S',
+        '%Y-%m-%d %H:%M:%S',
+        '%m/%d/%y %I:%M %p',
+    ],
+    'app': [
+        '%Y-%m-%d %H:%M:%S',
+        '%Y-%m-%d %H:%M',
+        '%m/%d/%Y %I:%M:%S %p',
+        '%m/%d/%Y %I:%M %p',
+        '%m/%d/%Y %H:%M',
+    ],
+}
+
+stats = {'parsed': 0, 'fallback': 0}
+
+def parse(val, vendor):
+    if not val:
+        return val
+
+    parsed, fallback = parse_cached(val.strip(), vendor)
+    stats['parsed'] += 1
+    if fallback:
+        stats['fallback'] += 1
+
+    return parsed
+
+def parse_column(values, vendor):
+    # parse() for a whole column, each distinct string once
+    parsed = {}
+    for val, count in collections.Counter(values).items():
+        if not val:
+            parsed[val] = val
+            continue
+
+        parsed[val], fallback = parse_cached(val.strip(), vendor)
+        stats['parsed'] += count
+        if fallback:
+            stats['fallback'] += count
+
+    return [parsed[val] for val in values]
+
+@functools.lru_cache(maxsize=65536)
+def parse_cached(val, vendor):
+    # exports are mostly minute resolution, so the same strings repeat a lot
+    vendor_formats = formats[vendor]
+
+    for i, fmt in enumerate(vendor_formats):
+        try:
+            naive = datetime.strptime(val, fmt)
+        except ValueError:
+            continue
+
+        if i > 0:
+            vendor_formats.insert(0, vendor_formats.pop(i))
+        return localize(naive), False
+
+    return localize(parser.parse(val, ignoretz=True)), True
+
+def localize(naive):
+    # new_york.localize(naive), which tries every offset the zone has had;
+    # New York's offset only ever changes on the hour
+    return naive.replace(tzinfo=get_tzinfo(naive.replace(minute=0, second=0, microsecond=0)))
+
+@functools.lru_cache(maxsize=65536)
+def get_tzinfo(hour):
+    return new_york.localize(hour).tzinfo
+
+def get_stats():
+    return dict(stats)
@@ -0,0 +1,42 @@
+#!/usr/bin/env python3
+from datetime import timedelta
+from sqlalchemy import Time, and_, cast, func, not_, text
+from sqlalchemy.dialects import postgresql
+from api import enforcement, tables
+
+ApTransactions = tables.ApTransactions
+
+def get_on_hours_filter():
+    # same window as enforcement.off_hours_start/off_hours_end, compared in UTC
+    purchased_time = cast(func.timezone('UTC', ApTransactions.purchased_date), Time)
+    return not_(and_(
+        purchased_time >= enforcement.off_hours_start.replace(tzinfo=None),
+        purchased_time < enforcement.off_hours_end.replace(tzinfo=None)
+    ))
+
+def get_revenue_sum(filters):
+    rows = ApTransactions.query.with_entities(
+        ApTransactions.stall, func.sum(ApTransactions.revenue)
+        ).filter(ApTransactions.revenue.isnot(None), get_on_hours_filter(), *filters
+        ).group_by(ApTransactions.stall).all()
+
+    return dict(rows)
+
+def get_bucketed_revenue(filters, time_intervals):
+    # width_bucket counts the boundaries <= its operand; backing off a
+    # microsecond turns that into bisect_left(time_intervals, purchased) so
+    # purchases on a boundary land in the bucket before it, as they always have
+    bucket = func.width_bucket(
+        ApTransactions.purchased_date - timedelta(microseconds=1),
+        postgresql.array(time_intervals)) - 1
+    rows = ApTransactions.query.with_entities(
+        bucket, func.sum(ApTransactions.revenue)
+        ).filter(ApTransactions.revenue.isnot(None), get_on_hours_filter(), *filters
+        ).group_by(text('1')).all()
+
+    bucketed_revenue = [0] * len(time_intervals)
+    for i, revenue in rows:
+        if i >= 0:
+            bucketed_revenue[i] = revenue
+
+    return bucketed_revenue
@@ -1,11 +1,12 @@
 #!/usr/bin/env python3
-import bisect, collections, operator, os, sys, pytz
-from datetime import datetime, timedelta, timezone, time
+import bisect, collections, functools, hashlib, itertools, operator, os, sys
+from datetime import datetime, timedelta, timezone
 from dateutil import parser
 from pathlib import Path
-from flask import Flask, json, jsonify, abort, request
+from flask import Flask, json, jsonify, abort, g, has_request_context, request
 from flask_cors import CORS
-from api import tables
+from sqlalchemy import BigInteger, cast, func, or_
+from api import aggregates, bucketing, cache, enforcement, intervals, jobs, metrics, rollup, sketch, snapshot, stalls, streaming, tables, timegrid
 sys.path.append(os.path.abspath(os.path.dirname(__file__) + '/' + '..'))
 import config
 
@@ -13,7 +14,16 @@ app = Flask(__name__)
 cors = CORS(app, resources={r"/*": {"origins": "*"}})
 app.config.from_object(os.environ['APP_SETTINGS'])
 tables.db.init_app(app)
+metrics.init_app(app)
 ApTransactions = tables.ApTransactions
+result_cache = cache.get_cache(app.config)
+data_version = cache.DataVersion(
+    lambda: tables.db.session.execute('SELECT max(version) FROM ap_data_version').scalar(),
+    app.config.get('CACHE_VERSION_TTL', 30))
+stall_inventory = stalls.StallInventory(data_version)
+max_transaction_length = timedelta(days=app.config.get('MAX_TRANSACTION_DAYS', 31))
+snapshot_source = snapshot.Snapshot(app.config.get('SNAPSHOT_PATH', '')) \
+    if app.config.get('ANALYTICS_BACKEND') == 'snapshot' else None
 
 days = { # todo: centralize somewhere else
     'monday': 0,
@@ -25,76 +35,388 @@ days = { # todo: centralize somewhere else
     'sunday': 6
 }
 
-midnight = time(4, 0, tzinfo=timezone.utc)
-off_hours_start = time(6, 0, tzinfo=timezone.utc) # 2am
-off_hours_end = time(13, 0, tzinfo=timezone.utc) # 9am
-cached_time = 0
-cached_interval = 0
+off_hours_start = enforcement.off_hours_start
+off_hours_end = enforcement.off_hours_end
 
 @app.route('/parking-spaces', methods = ['GET'])
 def get_parking_spaces():
-    pass
+    return jsonify({'data': stall_inventory.get_listing()})
+
+@app.route('/metrics', methods = ['GET'])
+def get_metrics():
+    if not metrics.enabled:
+        abort(404)
+
+    cache_stats = result_cache.get_stats() if result_cache is not None else None
+    return app.response_class(metrics.metrics.render(cache_stats),
+        mimetype='text/plain; version=0.0.4')
+
+def cached(route):
+    # serve repeated dashboard requests from result_cache until the next import
+    @functools.wraps(route)
+    def wrapper():
+        if result_cache is None:
+            return route()
+
+        with metrics.phase('cache'):
+            key = get_cache_key()
+            version = data_version.get()
+            body = result_cache.get(key, version)
+        if body is not None:
+            return app.response_class(body, mimetype='application/json')
+
+        response = route()
+        # streamed bodies would have to be buffered to be stored
+        if response.status_code == 200 and not response.is_streamed:
+            result_cache.set(key, version, response.get_data())
+
+        return response
+
+    return wrapper
+
+def get_cache_key(path = None):
+    # path defaults to the request's own, so a job can be keyed by the route it runs
+    params = get_params()
+    datetime_range = get_datetime_range(params)
+    key = json.dumps({
+        'endpoint': path or request.path,
+        'args': {arg: request.args.get(arg) for arg in ('day', 'heatmap', 'sum', 'percentiles')},
+        'datetime_range': [datetime_range['start'].isoformat(), datetime_range['end'].isoformat()],
+        'parking_spaces': params.get('parking_spaces'),
+        'metrics': params.get('metrics')
+    }, sort_keys=True)
+
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
 
 @app.route('/parking-occupancy', methods = ['POST'])
+@cached
 def get_parking_occupancy():
+    params = get_params()
+    return streaming.respond(get_occupancy_body(params, get_datetime_range(params), get_day(),
+        request.args.get('heatmap', default = False)))
+
+@app.route('/parking-revenue', methods = ['POST'])
+@cached
+def get_parking_revenue():
+    params = get_params()
+    return streaming.respond(get_revenue_body(params, get_datetime_range(params), get_day(),
+        request.args.get('sum', default = False)))
+
+@app.route('/parking-time', methods = ['POST'])
+@cached
+def get_parking_time():
+    params = get_params()
+    return streaming.respond(get_time_body(params, get_datetime_range(params), get_day(),
+        request.args.get('heatmap', default = False), get_percentiles()))
+
+@app.route('/parking-metrics', methods = ['POST'])
+@cached
+def get_parking_metrics():
+    # several of the endpoints above over one datetime_range and
+    # parking_spaces, computed from a single read of the transactions
     params = get_params()
     datetime_range = get_datetime_range(params)
-    day = get_day()
-    filters = get_filters(params, datetime_range, False, day)
-    spaces = ApTransactions.query.with_entities(
-        ApTransactions.stall, ApTransactions.purchased_date, ApTransactions.expiry_date
-        ).filter(*filters).order_by(ApTransactions.purchased_date).all()
-    transactions = get_squashed_transactions(spaces, datetime_range)
+    specs = get_metric_specs(params)
+
+    with metrics.phase('batch'):
+        g.batch_data = get_batch_data(params, datetime_range, specs)
+
+    results = []
+    for spec in specs:
+        # revenue takes ?sum= where the others take ?heatmap=
+        option = spec['sum'] if spec['metric'] == 'revenue' else spec['heatmap']
+        options = (option, spec['percentiles']) if spec['metric'] == 'time' else (option,)
+        body = metric_bodies[spec['metric']](params, datetime_range, spec['day'], *options)
+        results.append(streaming.get_body(body))
+
+    return jsonify({'data': results})
+
+# routes a job can run, each taking the same body and query string as it does directly
+job_endpoints = ('parking-occupancy', 'parking-revenue', 'parking-time', 'parking-metrics')
+
+@app.route('/jobs/<endpoint>', methods = ['POST'])
+def submit_job(endpoint):
+    # long ranges can outlast a proxy's timeout, so they are run in the
+    # background and polled for at /jobs/<id>
+    if endpoint not in job_endpoints:
+        abort(404)
+
+    path = '/' + endpoint
+    status = job_queue.submit(get_cache_key(path), endpoint,
+        (path, request.query_string, request.get_data()))
+
+    response = jsonify({'data': status})
+    response.status_code = 202
+    response.headers['Location'] = '/jobs/' + status['id']
+    return response
+
+@app.route('/jobs/<id>', methods = ['GET'])
+def get_job(id):
+    job = job_queue.get(id)
+    if job is None:
+        abort(404)
+
+    return jsonify({'data': job[0]})
+
+@app.route('/jobs/<id>/result', methods = ['GET'])
+def get_job_result(id):
+    # the route's own response once the job has finished
+    job = job_queue.get(id)
+    if job is None:
+        # the id is the route's result cache key, which may outlast the job
+        body = result_cache.get(id, data_version.get()) if result_cache is not None else None
+        if body is None:
+            abort(404)
+        return app.response_class(body, mimetype='application/json')
+
+    status, result = job
+    if status['status'] == 'failed':
+        abort(500)
+    if result is None:
+        response = jsonify({'data': status})
+        response.status_code = 202
+        return response
+
+    status_code, body, mimetype = result
+    return app.response_class(body, status=status_code, mimetype=mimetype)
+
+def run_job(job_request):
+    path, query_string, body = job_request
+    with app.test_request_context(path, method='POST', query_string=query_string,
+        data=body, content_type='application/json'):
+        g.buffered = True
+        try:
+            response = app.full_dispatch_request()
+        except Exception:
+            app.logger.exception('Job for ' + path + ' failed')
+            return None
+
+        return response.status_code, response.get_data(), response.mimetype
+
+job_queue = jobs.JobQueue(run_job, app.config.get('JOB_PATH', '/tmp/pavement-jobs.sqlite'),
+    app.config.get('JOB_WORKERS', 2), app.config.get('JOB_RESULT_TTL', 600))
+
+def get_occupancy_body(params, datetime_range, day, heatmap):
+    # bodies are a dict to return as it is, or the items of {'data': [...]}
+    # for streaming.respond
+    if day == 'week':
+        return get_week_body('occupancy', params, datetime_range)
+
+    if day is False and not heatmap and use_rollup(datetime_range, True):
+        time_intervals = get_time_intervals(datetime_range, True)
+        with metrics.phase('rollup'):
+            bucketed_occupancy = get_rollup_occupancy(params, datetime_range, time_intervals)
+        return format_bucketed_occupancy(bucketed_occupancy, time_intervals, params)
+
+    spaces = get_transactions(params, datetime_range, False, day, True)
+    with metrics.phase('squash'):
+        transactions = get_squashed_transactions(spaces, datetime_range)
 
     if day is not False:
-        return get_occupancy_by_day(transactions, datetime_range, params, day)
+        return get_occupancy_by_day(transactions, params, day,
+            *get_day_intervals(datetime_range, True, day))
 
-    heatmap = request.args.get('heatmap', default = False)
     if heatmap:
-        return get_occupancy(transactions, datetime_range, params)
+        return get_occupancy_data(transactions, datetime_range, params)
     else:
         time_intervals = get_time_intervals(datetime_range, True)
         return get_bucketed_occupancy(transactions, time_intervals, params)
 
-@app.route('/parking-revenue', methods = ['POST'])
-def get_parking_revenue():
-    params = get_params()
-    datetime_range = get_datetime_range(params)
-    day = get_day()
-    filters = get_filters(params, datetime_range, True, day)
-    spaces = ApTransactions.query.with_entities(
-        ApTransactions.stall, ApTransactions.purchased_date, ApTransactions.revenue
-        ).filter(*filters).all()
+def get_revenue_body(params, datetime_range, day, sum):
+    if day == 'week':
+        return get_week_body('revenue', params, datetime_range)
+
+    if day is False and use_rollup(datetime_range, not sum):
+        if sum:
+            with metrics.phase('rollup'):
+                revenue_sum = get_rollup_revenue_sum(params, datetime_range)
+            return revenue_sum
+
+        time_intervals = get_time_intervals(datetime_range)
+        with metrics.phase('rollup'):
+            bucketed_revenue = get_rollup_revenue(params, datetime_range, time_intervals)
+        return format_bucketed_revenue(bucketed_revenue, time_intervals)
 
+    # revenue is summed and bucketed in PostgreSQL or the snapshot, one row per group
     if day is not False:
-        return get_revenue_by_day(spaces, datetime_range, day)
+        return get_revenue_by_day(params, datetime_range, day,
+            *get_day_intervals(datetime_range, False, day))
 
-    sum = request.args.get('sum', default = False)
     if sum:
-        return get_revenue(spaces, datetime_range)
+        return get_stall_revenue(params, datetime_range)
     else:
         time_intervals = get_time_intervals(datetime_range)
-        return get_bucketed_revenue(spaces, time_intervals)
+        bucketed_revenue = get_bucketed_revenue_totals(params, datetime_range, time_intervals)
+        return format_bucketed_revenue(bucketed_revenue, time_intervals)
 
-@app.route('/parking-time', methods = ['POST'])
-def get_parking_time():
-    params = get_params()
-    datetime_range = get_datetime_range(params)
-    day = get_day()
-    filters = get_filters(params, datetime_range, True, day)
-    spaces = ApTransactions.query.with_entities(
-        ApTransactions.stall, ApTransactions.purchased_date, ApTransactions.expiry_date
-        ).filter(*filters).all()
+def get_time_body(params, datetime_range, day, heatmap, percentiles = None):
+    if day == 'week':
+        return get_week_body('time', params, datetime_range, percentiles)
+
+    # the rollup only has totals, so percentiles need the stays themselves
+    if day is False and not heatmap and percentiles is None and use_rollup(datetime_range, True):
+        time_intervals = get_time_intervals(datetime_range)
+        with metrics.phase('rollup'):
+            bucketed = get_rollup_times(params, datetime_range, time_intervals)
+        return format_bucketed_times(bucketed['times'], bucketed['spaces'], time_intervals)
+
+    spaces = get_transactions(params, datetime_range, True, day)
 
     if day is not False:
-        return get_times_by_day(spaces, datetime_range, day)
+        return get_times_by_day(spaces, day,
+            *get_day_intervals(datetime_range, False, day), percentiles)
 
-    heatmap = request.args.get('heatmap', default = False)
     if heatmap:
-        return get_times(spaces, datetime_range, params)
+        return get_times_data(spaces, datetime_range, params, percentiles)
     else:
         time_intervals = get_time_intervals(datetime_range)
-        return get_bucketed_times(spaces, time_intervals)
+        return get_bucketed_times(spaces, time_intervals, False, percentiles)
+
+def get_week_body(metric, params, datetime_range, percentiles = None):
+    # the ?day= result for every parking day, from one read of the transactions
+    # and one pass over the hours of the range
+    with metrics.phase('batch'):
+        g.batch_data = get_batch_data(params, datetime_range, [{'metric': metric, 'day': False}])
+    week = get_week_intervals(datetime_range, metric == 'occupancy')
+
+    results = []
+    for name, day in sorted(days.items(), key=operator.itemgetter(1)):
+        time_intervals, local_times = week[day]
+        if not any(local_time.weekday() == day for local_time in local_times):
+            # the range never reaches this parking day's enforced hours, or
+            # only the ones after midnight, which have no day to average over
+            results.append({'day': name, 'data': []})
+            continue
+
+        if metric == 'occupancy':
+            spaces = get_transactions(params, datetime_range, False, day, True)
+            with metrics.phase('squash'):
+                transactions = get_squashed_transactions(spaces, datetime_range)
+            profile = get_occupancy_by_day(transactions, params, day, time_intervals, local_times)
+        elif metric == 'revenue':
+            profile = get_revenue_by_day(params, datetime_range, day, time_intervals, local_times)
+        else:
+            spaces = get_transactions(params, datetime_range, True, day)
+            profile = get_times_by_day(spaces, day, time_intervals, local_times, percentiles)
+
+        results.append({'day': name, 'data': profile['data']})
+
+    return {'data': results}
+
+metric_bodies = {
+    'occupancy': get_occupancy_body,
+    'revenue': get_revenue_body,
+    'time': get_time_body
+}
+
+def get_metric_specs(params):
+    # [{'metric': 'occupancy', 'heatmap': true}, {'metric': 'revenue', 'day': 'monday'}, ...]
+    # taking the same options as the endpoints' query strings
+    specs = []
+    for spec in params.get('metrics') or []:
+        if spec.get('metric') not in metric_bodies:
+            abort(400)
+
+        percentiles = None
+        if spec.get('percentiles') is not None:
+            # only stay lengths have percentiles
+            if spec['metric'] != 'time':
+                abort(400)
+            percentiles = get_percentiles(spec['percentiles'])
+
+        specs.append({
+            'metric': spec['metric'],
+            'day': get_day(spec.get('day')),
+            'heatmap': bool(spec.get('heatmap')),
+            'sum': bool(spec.get('sum')),
+            'percentiles': percentiles
+        })
+
+    if not specs:
+        abort(400)
+
+    return specs
+
+def get_batch_data(params, datetime_range, specs):
+    # every row any of the specs needs, as columns the snapshot functions can
+    # select each spec's rows from
+    data = get_snapshot()
+    if data is not None:
+        return data
+
+    query = ApTransactions.query.with_entities(*get_batch_columns()).filter(
+        *get_batch_filters(params, datetime_range, specs))
+    return snapshot.from_rows(fetch(query))
+
+def get_batch_filters(params, datetime_range, specs):
+    # the union of get_filters for each spec
+    spec_days = [spec['day'] for spec in specs]
+    day = spec_days[0] if all(d is not False and d != 'week' and d == spec_days[0]
+        for d in spec_days) else False
+
+    if all(spec['metric'] != 'occupancy' for spec in specs):
+        return get_filters(params, datetime_range, True, day)
+
+    filters = get_filters(params, datetime_range, False, day)
+    # revenue and time also count purchases in the range without an expiry
+    filters[0] = or_(filters[0], datetime_range['start'] <= ApTransactions.purchased_date)
+    return filters
+
+def get_snapshot():
+    # the snapshot to read from, or None for PostgreSQL; a batch request
+    # reads from the rows it fetched
+    if has_request_context() and 'batch_data' in g:
+        return g.batch_data
+    return snapshot_source.get() if snapshot_source is not None else None
+
+def get_transactions(params, datetime_range, only_check_start = False, day = False, ordered = False):
+    # (stall, purchased, expiry) epoch rows matching get_filters; the snapshot
+    # always returns them in purchased_date order
+    data = get_snapshot()
+    if data is not None:
+        with metrics.phase('snapshot'):
+            rows = get_snapshot_rows(data, params, datetime_range, only_check_start, day)
+        return snapshot.get_rows(data, rows)
+
+    query = ApTransactions.query.with_entities(*get_epoch_columns()).filter(
+        *get_filters(params, datetime_range, only_check_start, day))
+    if ordered:
+        query = query.order_by(ApTransactions.purchased_date)
+
+    return fetch(query)
+
+def get_snapshot_rows(data, params, datetime_range, only_check_start = False, day = False):
+    earliest = None if only_check_start \
+        else intervals.to_epoch(datetime_range['start'] - max_transaction_length)
+    return snapshot.select(data, get_space_ids(params), get_epoch_range(datetime_range),
+        only_check_start, day, earliest)
+
+def get_stall_revenue(params, datetime_range):
+    data = get_snapshot()
+    if data is not None:
+        with metrics.phase('snapshot'):
+            rows = get_snapshot_rows(data, params, datetime_range, True)
+            return snapshot.get_revenue_sum(data, rows)
+
+    with metrics.phase('db'):
+        return aggregates.get_revenue_sum(get_filters(params, datetime_range, True))
+
+def get_bucketed_revenue_totals(params, datetime_range, time_intervals, day = False):
+    data = get_snapshot()
+    if data is not None:
+        with metrics.phase('snapshot'):
+            rows = get_snapshot_rows(data, params, datetime_range, True, day)
+            return snapshot.get_bucketed_revenue(data, rows, time_intervals)
+
+    with metrics.phase('db'):
+        return aggregates.get_bucketed_revenue(
+            get_filters(params, datetime_range, True, day), time_intervals)
+
+def fetch(query):
+    # rows come through a named server-side cursor in QUERY_CHUNK_SIZE
+    # batches, so every consumer below has to take them in a single pass
+    return metrics.timed_rows(query.execution_options(stream_results=True).yield_per(
+        app.config.get('QUERY_CHUNK_SIZE', 10000)))
 
 def get_params():
     return {} if not request.data else request.get_json()
@@ -116,25 +438,21 @@ def get_datetime_range(params):
 
     return {'start' : start_date, 'end': end_date}
 
-def get_squashed_transactions(spaces, datetime_range):
-    # get all transactions and remove overlapping time ranges
-    transactions = {}
-    for id, start_time, end_time in spaces:
-        if end_time is None:
-            continue
-        if id not in transactions:
-            transactions[id] = [{'start': start_time, 'end': end_time}]
-        else:
-            if start_time < transactions[id][-1]['end']:
-                start = transactions[id][-1]['end']
-            else:
-                start = start_time
-            if end_time <= transactions[id][-1]['end']:
-                continue
+def get_epoch_columns():
+    # occupancy works on epoch microseconds, so PostgreSQL hands those over
+    # instead of every row being turned into datetimes and back
+    return (ApTransactions.stall, intervals.get_epoch_column(ApTransactions.purchased_date),
+        intervals.get_epoch_column(ApTransactions.expiry_date))
 
-            transactions[id].append({'start': start, 'end': end_time})
+def get_batch_columns():
+    # the snapshot's columns, revenue in cents
+    return get_epoch_columns() + (cast(func.round(ApTransactions.revenue * 100), BigInteger),
+        ApTransactions.parking_day)
 
-    return transactions
+def get_squashed_transactions(spaces, datetime_range):
+    # get all transactions and remove overlapping time ranges; spaces are
+    # (stall, start, end) rows in epoch microseconds from get_epoch_columns
+    return intervals.get_keyed(spaces, True)
 
 def get_filters(params, datetime_range, only_check_start = False, day = False):
     if only_check_start:
@@ -145,17 +463,12 @@ def get_filters(params, datetime_range, only_check_start = False, day = False):
     else:
         filters = [
             datetime_range['start'] < ApTransactions.expiry_date,
-            datetime_range['end'] > ApTransactions.purchased_date
+            datetime_range['end'] > ApTransactions.purchased_date,
+            datetime_range['start'] - max_transaction_length < ApTransactions.purchased_date
         ]
 
-    if 'parking_spaces' in params:
-        if is_curbs(params['parking_spaces']):
-            spaces = []
-            for curb in params['parking_spaces']:
-                spaces += curb
-        else:
-            spaces = params['parking_spaces']
-
+    spaces = get_space_ids(params)
+    if spaces is not None:
         filters.append(ApTransactions.stall.in_(spaces))
 
     if day is not False:
@@ -163,6 +476,18 @@ def get_filters(params, datetime_range, only_check_start = False, day = False):
 
     return filters
 
+def get_space_ids(params):
+    if 'parking_spaces' not in params:
+        return None
+
+    if is_curbs(params['parking_spaces']):
+        spaces = []
+        for curb in params['parking_spaces']:
+            spaces += curb
+        return spaces
+
+    return params['parking_spaces']
+
 def get_time_intervals(datetime_range, include_end = False, time_delta = False, parking_day = False):
     if not time_delta:
         time_diff = (datetime_range['end'] - datetime_range['start']).total_seconds()
@@ -179,26 +504,17 @@ def get_time_delta(time_diff):
         return timedelta(weeks=1)
 
 def generate_times(datetime_range, delta, include_end, parking_day):
-    times = []
-    curr = datetime_range['start']
-    op = operator.le if include_end else operator.lt
-
-    while op(curr, datetime_range['end']):
-        if ((curr.timetz() >= off_hours_start and curr.timetz() < off_hours_end)
-            or (parking_day is not False and not in_parking_day(curr, parking_day))):
-            curr += delta
-            continue
-
-        times.append(curr)
-        curr += delta
+    return timegrid.get_times(datetime_range['start'], datetime_range['end'],
+        delta, include_end, parking_day)
 
-    if (include_end and times[-1] != datetime_range['end']):
-        if parking_day is False:
-            times.append(datetime_range['end'])
-        else:
-            times.append(times[-1] + delta)
+def get_day_intervals(datetime_range, include_end, parking_day):
+    # generate_times(datetime_range, timedelta(hours=1), include_end, parking_day)
+    # with the New York time of each boundary
+    return get_week_intervals(datetime_range, include_end)[parking_day]
 
-    return times
+def get_week_intervals(datetime_range, include_end):
+    # the hourly boundaries of every parking day at once; {parking_day: (times, local_times)}
+    return timegrid.get_week(datetime_range['start'], datetime_range['end'], include_end)
 
 def get_bucketed_spaces(spaces, times):
     bucketed_spaces = [set() for _ in times]
@@ -214,29 +530,15 @@ def get_bucketed_spaces(spaces, times):
 
     return bucketed_spaces
 
-def get_occupancy_by_day(spaces, datetime_range, params, day):
-    time_intervals = get_time_intervals(datetime_range, True, timedelta(hours=1), day)
-    hour_occupancy = {}
+def get_occupancy_by_day(spaces, params, day, time_intervals, local_times):
     occupancy = get_bucketed_occupancy(spaces, time_intervals, params, True)
-    days = 0
-    curr_date = None
-
-    for i, timestamp in enumerate(time_intervals):
-        timestamp = timestamp.astimezone(pytz.timezone('America/New_York'))
-        if timestamp.weekday() == day and curr_date != timestamp.date():
-            days += 1
-
-        curr_date = timestamp.date()
-        hour = timestamp.timetz()
-        if hour not in hour_occupancy:
-            hour_occupancy[hour] = occupancy['bucketed'][i] / occupancy['potential'][i]
-        else:
-            hour_occupancy[hour] += occupancy['bucketed'][i] / occupancy['potential'][i]
+    values = [bucketed / potential
+        for bucketed, potential in zip(occupancy['bucketed'], occupancy['potential'])]
 
-    return jsonify(get_ordered_results(hour_occupancy, days))
+    return get_hourly_results(values, local_times, day)
 
-def get_occupancy(spaces, datetime_range, params):
-    occupancy = {'data': []}
+def get_occupancy_data(spaces, datetime_range, params):
+    bounds = get_epoch_range(datetime_range)
 
     if 'parking_spaces' in params and is_curbs(params['parking_spaces']):
         for curb in params['parking_spaces']:
@@ -249,15 +551,15 @@ def get_occupancy(spaces, datetime_range, params):
 
                 if space in spaces:
                     for transaction in spaces[space]:
-                        time_range = get_bound_time_range(transaction, datetime_range)
+                        time_range = get_bound_time_range(transaction, bounds)
                         if not time_range:
                             continue
-                        space_time += (time_range['end'] - time_range['start']).total_seconds()
+                        space_time += intervals.to_seconds(time_range[1] - time_range[0])
 
                 curb_time += space_time
 
             curb_occupancy = round(curb_time / potential_curb_time, 2)
-            occupancy['data'].append({'value': curb_occupancy, 'space': curb})
+            yield {'value': curb_occupancy, 'space': curb}
     else:
         potential_time = get_potential_occupancy(datetime_range['start'], datetime_range['end'])
 
@@ -265,55 +567,46 @@ def get_occupancy(spaces, datetime_range, params):
             space_time = 0
 
             for transaction in transactions:
-                time_range = get_bound_time_range(transaction, datetime_range)
+                time_range = get_bound_time_range(transaction, bounds)
                 if not time_range:
                     continue
-                space_time += (time_range['end'] - time_range['start']).total_seconds()
+                space_time += intervals.to_seconds(time_range[1] - time_range[0])
 
             space_time = round(space_time / potential_time, 2)
-            occupancy['data'].append({'value': space_time, 'space': id})
+            yield {'value': space_time, 'space': id}
 
         if 'parking_spaces' in params:
             for space in params['parking_spaces']:
                 if space not in spaces:
-                    occupancy['data'].append({'value': 0, 'space': space})
-
-    return jsonify(occupancy)
+                    yield {'value': 0, 'space': space}
 
 def get_bucketed_occupancy(spaces, time_intervals, params, return_raw = False):
+    with metrics.phase('bucket'):
+        bucketed_occupancy = get_bucketed_seconds(spaces, time_intervals)
+    return format_bucketed_occupancy(bucketed_occupancy, time_intervals, params, return_raw)
+
+def get_bucketed_seconds(spaces, time_intervals):
     bucketed_occupancy = [0] * (len(time_intervals) - 1)
+    last = len(time_intervals) - 1
+    boundaries = [intervals.to_epoch(t) for t in time_intervals]
 
     for id, transactions in spaces.items():
-        data = get_time_data(
-            transactions[0]['start'], # first transaction
-            transactions[-1]['end'], # last transaction
-            time_intervals
-        )
-
-        for i in range(data['start_index'], data['end_index']):
-            for transaction in transactions:
-                if (transaction['start'] > time_intervals[i+1]
-                    or transaction['end'] < time_intervals[i]):
-                    continue
-
-                data = get_time_data(
-                    transaction['start'],
-                    transaction['end'],
-                    time_intervals
-                )
-
-                if transaction['start'] < time_intervals[i]:
-                    data['start_time'] = time_intervals[i]
-                else:
-                    data['start_time'] = transaction['start']
-                if transaction['end'] > time_intervals[i+1]:
-                    data['end_time'] = time_intervals[i+1]
-                else:
-                    data['end_time'] = transaction['end']
-
-                bucketed_occupancy[i] += get_time_occupied(i, data, time_intervals)
-
-    potential_occupancy = get_potential_occupancy_bucketed(params, time_intervals)
+        # squashed transactions don't overlap, so each one only has to visit
+        # the buckets between its own boundaries
+        for start, end in transactions:
+            i = max(bisect.bisect_right(boundaries, start) - 1, 0)
+
+            while i < last and boundaries[i] < end:
+                start_time = max(start, boundaries[i])
+                end_time = min(end, boundaries[i+1])
+                bucketed_occupancy[i] += intervals.to_seconds(end_time - start_time)
+                i += 1
+
+    return bucketed_occupancy
+
+def format_bucketed_occupancy(bucketed_occupancy, time_intervals, params, return_raw = False):
+    with metrics.phase('potential'):
+        potential_occupancy = get_potential_occupancy_bucketed(params, time_intervals)
     del time_intervals[-1]
 
     if return_raw:
@@ -322,98 +615,32 @@ def get_bucketed_occupancy(spaces, time_intervals, params, return_raw = False):
             'potential': potential_occupancy
         }
 
-    return jsonify({
-        'data': [{
-            'timestamp': timestamp,
-            'value': round(bucketed_occupancy[i] / potential_occupancy[i], 2),
-            } for i, timestamp in enumerate(time_intervals)]
-    })
-
-def get_revenue_by_day(spaces, datetime_range, day):
-    time_intervals = get_time_intervals(datetime_range, False, timedelta(hours=1), day)
-    hour_revenue = {}
-    bucketed_revenue = get_bucketed_revenue(spaces, time_intervals, True)
-    days = 0
-    curr_date = None
-
-    for i, timestamp in enumerate(time_intervals):
-        timestamp = timestamp.astimezone(pytz.timezone('America/New_York'))
-        if timestamp.weekday() == day and curr_date != timestamp.date():
-            days += 1
-
-        curr_date = timestamp.date()
-        hour = timestamp.timetz()
-        if hour not in hour_revenue:
-            hour_revenue[hour] = bucketed_revenue[i]
-        else:
-            hour_revenue[hour] += bucketed_revenue[i]
-
-    return jsonify(get_ordered_results(hour_revenue, days))
-
-def get_revenue(spaces, datetime_range):
-    revenue_sum = {}
-
-    for id, start_time, revenue in spaces:
-        if (revenue is None
-            or (start_time.timetz() >= off_hours_start
-                and start_time.timetz() < off_hours_end)):
-            continue
-
-        if id not in revenue_sum:
-            revenue_sum[id] = revenue
-        else:
-            revenue_sum[id] += revenue
-
-    return jsonify(revenue_sum)
-
-def get_bucketed_revenue(spaces, time_intervals, return_raw = False):
-    bucketed_revenue = [0] * len(time_intervals)
-
-    for id, start_time, revenue in spaces:
-        if (revenue is None
-            or (start_time.timetz() >= off_hours_start
-                and start_time.timetz() < off_hours_end)):
-            continue
+    return ({
+        'timestamp': timestamp,
+        'value': round(bucketed_occupancy[i] / potential_occupancy[i], 2),
+        } for i, timestamp in enumerate(time_intervals))
 
-        start_index = bisect.bisect_left(time_intervals, start_time) - 1
-        if start_index < 0:
-            continue
-        bucketed_revenue[start_index] += revenue
+def get_revenue_by_day(params, datetime_range, day, time_intervals, local_times):
+    bucketed_revenue = get_bucketed_revenue_totals(params, datetime_range, time_intervals, day)
+    return get_hourly_results(bucketed_revenue, local_times, day)
 
+def format_bucketed_revenue(bucketed_revenue, time_intervals, return_raw = False):
     if return_raw:
         return bucketed_revenue
 
-    return jsonify({
-        'data': [{
-            'timestamp': timestamp,
-            'value': bucketed_revenue[i],
-            } for i, timestamp in enumerate(time_intervals)]
-    })
-
-def get_times_by_day(spaces, datetime_range, day):
-    time_intervals = get_time_intervals(datetime_range, False, timedelta(hours=1), day)
-    hour_times = {}
-    bucketed = get_bucketed_times(spaces, time_intervals, True)
-    days = 0
-    curr_date = None
-
-    for i, timestamp in enumerate(time_intervals):
-        timestamp = timestamp.astimezone(pytz.timezone('America/New_York'))
-        if timestamp.weekday() == day and curr_date != timestamp.date():
-            days += 1
-
-        curr_date = timestamp.date()
-        hour = timestamp.timetz()
-        if hour not in hour_times:
-            hour_times[hour] = seconds_to_hours(bucketed['times'][i] / bucketed['spaces'][i])
-        else:
-            hour_times[hour] += seconds_to_hours(bucketed['times'][i] / bucketed['spaces'][i])
+    return ({
+        'timestamp': timestamp,
+        'value': bucketed_revenue[i],
+        } for i, timestamp in enumerate(time_intervals))
 
-    return jsonify(get_ordered_results(hour_times, days))
+def get_times_by_day(spaces, day, time_intervals, local_times, percentiles = None):
+    bucketed = get_bucketed_times(spaces, time_intervals, True, percentiles)
+    values = [seconds_to_hours(times / count)
+        for times, count in zip(bucketed['times'], bucketed['spaces'])]
 
-def get_times(spaces, datetime_range, params):
-    times = {'data': []}
+    return get_hourly_results(values, local_times, day, bucketed.get('sketches'), percentiles)
 
+def get_times_data(spaces, datetime_range, params, percentiles = None):
     if 'parking_spaces' in params and is_curbs(params['parking_spaces']):
         spaces = get_keyed_spaces(spaces)
         for curb in params['parking_spaces']:
@@ -424,76 +651,115 @@ def get_times(spaces, datetime_range, params):
                 space_time = 0
 
                 if space in spaces:
-                    for transaction in spaces[space]:
-                        space_time += (transaction['end'] - transaction['start']).total_seconds()
+                    for start, end in spaces[space]:
+                        space_time += intervals.to_seconds(end - start)
 
                     curb_time += space_time / len(spaces[space])
                 else:
                     unused_spaces += 1
 
             curb_time = curb_time / (len(curb) - unused_spaces)
-            times['data'].append({'value': seconds_to_hours(curb_time), 'space': curb})
+            item = {'value': seconds_to_hours(curb_time), 'space': curb}
+            if percentiles is not None:
+                curb_sketch = sketch.merge(get_stay_sketch(spaces[space])
+                    for space in curb if space in spaces)
+                item['percentiles'] = get_percentile_values(curb_sketch, percentiles)
+            yield item
     else:
-        keyed_spaces = {}
-        for id, start_time, end_time in spaces:
-            if end_time is None:
-                continue
-
-            if id not in keyed_spaces:
-                keyed_spaces[id] = [{'start': start_time, 'end': end_time}]
-            else:
-                keyed_spaces[id].append({'start': start_time, 'end': end_time})
+        keyed_spaces = get_keyed_spaces(spaces)
 
         for id, transactions in keyed_spaces.items():
             space_time = 0
-            for transaction in transactions:
-                space_time += (transaction['end'] - transaction['start']).total_seconds()
+            for start, end in transactions:
+                space_time += intervals.to_seconds(end - start)
 
             space_time = space_time / len(transactions)
-            times['data'].append({'value': seconds_to_hours(space_time), 'space': id})
+            item = {'value': seconds_to_hours(space_time), 'space': id}
+            if percentiles is not None:
+                item['percentiles'] = get_percentile_values(get_stay_sketch(transactions), percentiles)
+            yield item
 
         if 'parking_spaces' in params:
             for space in params['parking_spaces']:
                 if space not in keyed_spaces:
-                    times['data'].append({'value': 0, 'space': space})
-
-    return jsonify(times)
-
-def get_bucketed_times(spaces, time_intervals, return_raw = False):
-    bucketed_times = [0] * (len(time_intervals))
-    bucketed_spaces = [0] * (len(time_intervals))
-
-    for id, start_time, end_time in spaces:
-        if (end_time is None
-            or (start_time.timetz() >= off_hours_start
-                and start_time.timetz() < off_hours_end)):
-            continue
-
-        start_index = bisect.bisect_left(time_intervals, start_time) - 1
-        if start_index < 0:
-            continue
-
-        bucketed_times[start_index] += (end_time - start_time).total_seconds()
-        bucketed_spaces[start_index] += 1
-
+                    item = {'value': 0, 'space': space}
+                    if percentiles is not None:
+                        item['percentiles'] = get_percentile_values(sketch.Sketch(), percentiles)
+                    yield item
+
+def get_bucketed_times(spaces, time_intervals, return_raw = False, percentiles = None):
+    sketches = None if percentiles is None else [sketch.Sketch() for _ in time_intervals]
+    with metrics.phase('bucket'):
+        bucketed_times, bucketed_spaces = bucketing.bucket_times(spaces, time_intervals, sketches)
+    return format_bucketed_times(bucketed_times, bucketed_spaces, time_intervals, return_raw,
+        sketches, percentiles)
+
+def format_bucketed_times(bucketed_times, bucketed_spaces, time_intervals, return_raw = False,
+    sketches = None, percentiles = None):
     for i, space in enumerate(bucketed_spaces):
         if space == 0:
             bucketed_spaces[i] += 1
 
     if return_raw:
-        return {
+        bucketed = {
             'times': bucketed_times,
             'spaces': bucketed_spaces
         }
+        if sketches is not None:
+            bucketed['sketches'] = sketches
+        return bucketed
 
-    return jsonify({
-        'data': [{
+    if sketches is not None:
+        return ({
             'timestamp': timestamp,
             'value': seconds_to_hours(bucketed_times[i] / bucketed_spaces[i]),
-        } for i, timestamp in enumerate(time_intervals)]
-    })
+            'percentiles': get_percentile_values(sketches[i], percentiles)
+            } for i, timestamp in enumerate(time_intervals))
+
+    return ({
+        'timestamp': timestamp,
+        'value': seconds_to_hours(bucketed_times[i] / bucketed_spaces[i]),
+        } for i, timestamp in enumerate(time_intervals))
+
+def get_stay_sketch(transactions):
+    # transactions is one stall's Intervals from an IntervalStore
+    return sketch.from_stays(transactions.starts, transactions.ends)
+
+def get_percentile_values(stay_sketch, percentiles):
+    # {'50': hours, '90': hours, ...}
+    return {'{:g}'.format(percentile): seconds_to_hours(stay_sketch.quantile(percentile / 100))
+        for percentile in percentiles}
+
+def get_hourly_results(values, local_times, day, sketches = None, percentiles = None):
+    # averages each bucket's value over the weeks of the parking day, by the
+    # New York hour its bucket starts in; sketches of the buckets in an hour
+    # are merged instead
+    hour_values = {}
+    hour_sketches = None if sketches is None else {}
+    days = 0
+    curr_date = None
+
+    for i, (value, timestamp) in enumerate(zip(values, local_times)):
+        if timestamp.weekday() == day and curr_date != timestamp.date():
+            days += 1
 
-def get_ordered_results(results, days):
+        curr_date = timestamp.date()
+        hour = timestamp.timetz()
+        if hour not in hour_values:
+            hour_values[hour] = value
+        else:
+            hour_values[hour] += value
+
+        if sketches is not None:
+            hour_sketches.setdefault(hour, sketch.Sketch()).merge(sketches[i])
+
+    if hour_sketches is None:
+        return get_ordered_results(hour_values, days)
+
+    return get_ordered_results(hour_values, days, {hour: get_percentile_values(hour_sketch, percentiles)
+        for hour, hour_sketch in hour_sketches.items()})
+
+def get_ordered_results(results, days, hour_percentiles = None):
     ordered_results = collections.OrderedDict(sorted(results.items()))
     results_by_day = {'data': []}
     for hour, value in ordered_results.items():
@@ -501,44 +767,21 @@ def get_ordered_results(results, days):
         first_hour = format_hour(hour)
         next_hour = format_hour(get_next_hour(hour))
         timestamp = first_hour + '-' + next_hour
-        results_by_day['data'].append({'timestamp': timestamp, 'value': avg_value})
+        item = {'timestamp': timestamp, 'value': avg_value}
+        if hour_percentiles is not None:
+            item['percentiles'] = hour_percentiles[hour]
+        results_by_day['data'].append(item)
 
     return rearrange_times(results_by_day)
 
-def get_time_data(start_time, end_time, times):
-    start_index = bisect.bisect_left(times, start_time) - 1
-    end_index = bisect.bisect_right(times, end_time)
-    data = {
-        'start_time': start_time, 'end_time': end_time,
-        'start_index': start_index, 'end_index': end_index
-    }
-
-    if start_index < 0:
-        data['start_index'] = 0
-        data['start_time'] = times[data['start_index']]
-    if end_index == len(times):
-        data['end_index'] = end_index - 1
-        data['end_time'] = times[data['end_index']]
-
-    return data
-
-def get_time_occupied(i, time_data, times):
-    if time_data['start_index'] == (time_data['end_index'] - 1):
-        return (time_data['end_time'] - time_data['start_time']).total_seconds()
-    elif i == time_data['start_index']:
-        return (times[i+1] - time_data['start_time']).total_seconds()
-    elif i == (time_data['end_index'] - 1):
-        return (time_data['end_time'] - times[i]).total_seconds()
-    else:
-        return (times[i+1] - times[i]).total_seconds()
-
 def get_potential_occupancy_bucketed(params, time_intervals):
     potential_occupancy = [0] * (len(time_intervals) - 1)
     if 'parking_spaces' in params:
         space_count = len(params['parking_spaces'])
     else:
-        # slowish query we can worry about optimizing later when we get more data
-        space_count = 3693
+        # every stall with a purchase somewhere in the range; an empty range
+        # still needs a denominator
+        space_count = stall_inventory.count_active(time_intervals[0], time_intervals[-1]) or 1
 
     for i, interval in enumerate(time_intervals):
         if i == len(time_intervals) - 1:
@@ -550,73 +793,58 @@ def get_potential_occupancy_bucketed(params, time_intervals):
     return potential_occupancy
 
 def get_potential_occupancy(start_time, end_time):
-    global cached_time
-    global cached_interval
-
-    if cached_interval > 0 and (end_time - start_time).total_seconds() == cached_interval:
-        return cached_time
-
-    seconds = 0
-    delta = timedelta(seconds=1)
-    curr = start_time
-
-    while curr < end_time:
-        curr += delta
-        if curr.timetz() == off_hours_start:
-            curr += timedelta(hours=7)
-        seconds += 1
-
-    cached_time = seconds
-    cached_interval = (end_time - start_time).total_seconds()
-    return seconds
+    return enforcement.get_enforceable_seconds(start_time, end_time)
 
 def get_keyed_spaces(spaces):
-    keyed_spaces = {}
-
-    for id, start_time, end_time in spaces:
-        if end_time is None:
-            continue
-
-        if id not in keyed_spaces:
-            keyed_spaces[id] = [{'start': start_time, 'end': end_time}]
-        else:
-            keyed_spaces[id].append({'start': start_time, 'end': end_time})
-
-    return keyed_spaces
+    return intervals.get_keyed(spaces)
 
 def is_curbs(spaces):
     return isinstance(spaces[0], list)
 
-def get_bound_time_range(transaction, datetime_range):
-    if (transaction['start'] > datetime_range['end']
-        or transaction['end'] < datetime_range['start']):
+def get_epoch_range(datetime_range):
+    return {
+        'start': intervals.to_epoch(datetime_range['start']),
+        'end': intervals.to_epoch(datetime_range['end'])
+    }
+
+def get_bound_time_range(transaction, epoch_range):
+    # transaction is a (start, end) pair from an IntervalStore
+    start, end = transaction
+    if start > epoch_range['end'] or end < epoch_range['start']:
         # this could happen when receiving squashed transactions
         return False
 
-    if transaction['start'] < datetime_range['start']:
-        start_time = datetime_range['start']
-    else:
-        start_time = transaction['start']
-    if transaction['end'] > datetime_range['end']:
-        end_time = datetime_range['end']
-    else:
-        end_time = transaction['end']
-
-    return {'start': start_time, 'end': end_time}
+    return (max(start, epoch_range['start']), min(end, epoch_range['end']))
 
 def seconds_to_hours(seconds):
     return round(seconds / 3600, 2)
 
-def in_parking_day(dt, parking_day):
-    day = dt.astimezone(pytz.timezone('America/New_York')).weekday()
-    if dt.timetz() >= midnight and dt.timetz() < off_hours_start:
-        day = 6 if day == 0 else day - 1
-
-    return day == parking_day
-
-def get_day():
-    day = request.args.get('day', default = False)
-
+def get_percentiles(percentiles = None):
+    # ?percentiles=50,90, or a metrics spec's [50, 90] or '50,90', as
+    # [50.0, 90.0], or None
+    if percentiles is None:
+        percentiles = request.args.get('percentiles', default = None)
+    if not percentiles:
+        return None
+
+    if isinstance(percentiles, str):
+        percentiles = percentiles.split(',')
+    try:
+        percentiles = [float(percentile) for percentile in percentiles]
+    except (TypeError, ValueError):
+        abort(400)
+    if any(not 0 <= percentile <= 100 for percentile in percentiles):
+        abort(400)
+
+    return percentiles
+
+def get_day(day = None):
+    # a parking day, 'week' for all of them, or False
+    if day is None:
+        day = request.args.get('day', default = False)
+
+    if day and day.lower() == 'week':
+        return 'week'
     if day and day.lower() in days:
         return days[day.lower()]
 
@@ -640,5 +868,134 @@ def rearrange_times(result):
 def format_hour(hour):
     return hour.strftime('%I:%M%p').lstrip('0')
 
+def use_rollup(datetime_range, bucketed = False):
+    # bucketed results can only come from whole hours when every bucket
+    # boundary is on the hour, which holds when the range starts on one
+    if not app.config.get('USE_HOURLY_ROLLUP') or get_snapshot() is not None:
+        return False
+    if bucketed and not rollup.is_aligned(datetime_range['start']):
+        return False
+
+    return rollup.get_hours(datetime_range) is not False
+
+def get_rollup_edges(datetime_range, hours):
+    # the parts of datetime_range outside the rollup's whole hours
+    edges = [
+        {'start': datetime_range['start'], 'end': hours['start']},
+        {'start': hours['end'], 'end': datetime_range['end']}
+    ]
+
+    return [edge for edge in edges if edge['start'] < edge['end']]
+
+def get_rollup_edge_rows(params, datetime_range, hours, *columns):
+    rows = []
+    for edge in get_rollup_edges(datetime_range, hours):
+        rows = itertools.chain(rows, fetch(ApTransactions.query.with_entities(*columns).filter(
+            *get_filters(params, edge, True))))
+
+    return rows
+
+def get_rollup_boundary_rows(params, hours, time_intervals, *columns):
+    # purchases made exactly on a bucket boundary: the rollup counts those in
+    # the bucket starting there while bisect_left puts them in the one before
+    boundaries = [t for t in time_intervals if hours['start'] <= t < hours['end']]
+    if not boundaries:
+        return []
+
+    filters = get_filters(params, hours, True) + [ApTransactions.purchased_date.in_(boundaries)]
+    return ApTransactions.query.with_entities(*columns).filter(*filters).all()
+
+def get_rollup_occupancy(params, datetime_range, time_intervals):
+    hours = rollup.get_hours(datetime_range)
+    bucketed_occupancy = [0] * (len(time_intervals) - 1)
+
+    for hour, seconds in rollup.get_occupied_seconds(hours, get_space_ids(params)):
+        # a range starting in the off hours has rollup hours before its first
+        # boundary, which the raw rows path leaves out too
+        i = bisect.bisect_right(time_intervals, hour) - 1
+        if i >= 0:
+            bucketed_occupancy[i] += seconds
+
+    if hours['end'] < datetime_range['end']:
+        # the last bucket ends with the range, part way through an hour
+        edge = {'start': hours['end'], 'end': datetime_range['end']}
+        spaces = fetch(ApTransactions.query.with_entities(*get_epoch_columns()
+            ).filter(*get_filters(params, edge)).order_by(ApTransactions.purchased_date))
+        seconds = get_bucketed_seconds(
+            get_squashed_transactions(spaces, edge), [edge['start'], edge['end']])
+        bucketed_occupancy[-1] += seconds[0]
+
+    return bucketed_occupancy
+
+def get_rollup_revenue(params, datetime_range, time_intervals):
+    hours = rollup.get_hours(datetime_range)
+    bucketed_revenue = [0] * len(time_intervals)
+
+    for hour, revenue, count, paid in rollup.get_purchases(hours, get_space_ids(params)):
+        i = bisect.bisect_right(time_intervals, hour) - 1
+        if revenue is not None and i >= 0:
+            bucketed_revenue[i] += revenue
+
+    for edge in get_rollup_edges(datetime_range, hours):
+        edge_revenue = aggregates.get_bucketed_revenue(
+            get_filters(params, edge, True), time_intervals)
+        for i, revenue in enumerate(edge_revenue):
+            bucketed_revenue[i] += revenue
+
+    boundary = get_rollup_boundary_rows(params, hours, time_intervals,
+        ApTransactions.stall, ApTransactions.purchased_date, ApTransactions.revenue)
+    for id, start_time, revenue in boundary:
+        if revenue is None:
+            continue
+        i = bisect.bisect_right(time_intervals, start_time) - 1
+        bucketed_revenue[i] -= revenue
+        if i > 0:
+            bucketed_revenue[i-1] += revenue
+
+    return bucketed_revenue
+
+def get_rollup_revenue_sum(params, datetime_range):
+    hours = rollup.get_hours(datetime_range)
+    revenue_sum = dict(rollup.get_stall_revenue(hours, get_space_ids(params)))
+
+    for edge in get_rollup_edges(datetime_range, hours):
+        for id, revenue in aggregates.get_revenue_sum(get_filters(params, edge, True)).items():
+            revenue_sum[id] = revenue_sum.get(id, 0) + revenue
+
+    return revenue_sum
+
+def get_rollup_times(params, datetime_range, time_intervals):
+    hours = rollup.get_hours(datetime_range)
+    bucketed_times = [0] * len(time_intervals)
+    bucketed_spaces = [0] * len(time_intervals)
+
+    for hour, revenue, count, paid in rollup.get_purchases(hours, get_space_ids(params)):
+        i = bisect.bisect_right(time_intervals, hour) - 1
+        if i < 0:
+            continue
+        bucketed_times[i] += paid
+        bucketed_spaces[i] += count
+
+    edges = get_rollup_edge_rows(params, datetime_range, hours, *get_epoch_columns())
+    boundary = get_rollup_boundary_rows(params, hours, time_intervals,
+        ApTransactions.stall, ApTransactions.purchased_date, ApTransactions.expiry_date)
+    edge_times, edge_spaces = bucketing.bucket_times(edges, time_intervals)
+
+    for i in range(len(time_intervals)):
+        bucketed_times[i] += edge_times[i]
+        bucketed_spaces[i] += edge_spaces[i]
+
+    for id, start_time, end_time in boundary:
+        if end_time is None:
+            continue
+        i = bisect.bisect_right(time_intervals, start_time) - 1
+        bucketed_times[i] -= (end_time - start_time).total_seconds()
+        bucketed_spaces[i] -= 1
+        if i > 0:
+            bucketed_times[i-1] += (end_time - start_time).total_seconds()
+            bucketed_spaces[i-1] += 1
+
+    return {'times': bucketed_times, 'spaces': bucketed_spaces}
+
 if __name__ == "__main__":
     app.run(host='0.0.0.0')
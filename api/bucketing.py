@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+import itertools
+import numpy as np
+from api import enforcement, sketch
+
+chunk_size = 10000
+
+def to_epochs(times):
+    return np.array([t.timestamp() for t in times], dtype=np.float64)
+
+def on_hours_mask(epochs):
+    seconds = np.mod(epochs, enforcement.day_seconds)
+    return (seconds < enforcement.window_start) \
+        | (seconds >= enforcement.window_start + enforcement.window_length)
+
+def get_bucket_indexes(epochs, boundaries):
+    # same bucket as bisect_left(time_intervals, start) - 1; -1 is before the first
+    return np.searchsorted(boundaries, epochs, side='left') - 1
+
+def get_chunks(spaces):
+    # rows may come straight off a server-side cursor, so only one chunk of
+    # them is turned into arrays at a time
+    spaces = iter(spaces)
+    while True:
+        chunk = list(itertools.islice(spaces, chunk_size))
+        if not chunk:
+            return
+        yield chunk
+
+def bucket_times(spaces, time_intervals, sketches = None):
+    # spaces are (stall, start, end) rows in epoch microseconds; each stay
+    # also goes into sketches[bucket] when a list of sketches is given
+    boundaries = to_epochs(time_intervals)
+    length = len(time_intervals)
+    times = np.zeros(length, dtype=np.float64)
+    counts = np.zeros(length, dtype=np.int64)
+
+    for chunk in get_chunks(spaces):
+        starts = []
+        ends = []
+        for id, start, end in chunk:
+            if end is None:
+                continue
+            starts.append(start)
+            ends.append(end)
+
+        # the same float seconds datetime.timestamp() gives
+        starts = np.array(starts, dtype=np.int64) / 1000000
+        ends = np.array(ends, dtype=np.int64) / 1000000
+        indexes = get_bucket_indexes(starts, boundaries)
+        keep = on_hours_mask(starts) & (indexes >= 0)
+
+        times += np.bincount(indexes[keep], weights=ends[keep] - starts[keep], minlength=length)
+        counts += np.bincount(indexes[keep], minlength=length)
+        if sketches is not None:
+            sketch.add_grouped(sketches, indexes[keep], ends[keep] - starts[keep])
+
+    return times.tolist(), counts.tolist()
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+import collections, os, sqlite3, threading, time
+
+class MemoryCache:
+    """LRU cache of response bodies for one process"""
+    def __init__(self, max_entries):
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()
+        self.version = None
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key, version):
+        with self.lock:
+            self.set_version(version)
+            value = self.entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, version, value):
+        with self.lock:
+            self.set_version(version)
+            self.entries[key] = value
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def set_version(self, version):
+        # everything cached before an import is stale afterwards
+        if version != self.version:
+            self.entries.clear()
+            self.version = version
+
+    def get_stats(self):
+        return {
+            'backend': 'memory',
+            'entries': len(self.entries),
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+class SqliteCache:
+    """LRU cache of response bodies in a local SQLite file shared by all workers"""
+    def __init__(self, path, max_entries):
+        self.path = path
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        self.connection = None
+        self.pid = None
+        self.hits = 0
+        self.misses = 0
+
+    def connect(self):
+        # connections can't cross a fork, so each worker opens its own
+        if self.connection is None or self.pid != os.getpid():
+            self.connection = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS entries (
+                key TEXT PRIMARY KEY, version TEXT, value BLOB, used REAL)""")
+            self.connection.execute('CREATE INDEX IF NOT EXISTS entries_used ON entries (used)')
+            self.pid = os.getpid()
+
+        return self.connection
+
+    def get(self, key, version):
+        with self.lock:
+            connection = self.connect()
+            row = connection.execute('SELECT value FROM entries WHERE key = ? AND version = ?',
+                (key, str(version))).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+
+            with connection:
+                connection.execute('UPDATE entries SET used = ? WHERE key = ?', (time.time(), key))
+            self.hits += 1
+            return bytes(row[0])
+
+    def set(self, key, version, value):
+        with self.lock:
+            connection = self.connect()
+            with connection:
+                connection.execute('DELETE FROM entries WHERE version != ?', (str(version),))
+                connection.execute('INSERT OR REPLACE INTO entries VALUES (?, ?, ?, ?)',
+                    (key, str(version), value, time.time()))
+                connection.execute("""DELETE FROM entries WHERE key IN (
+                    SELECT key FROM entries ORDER BY used DESC LIMIT -1 OFFSET ?)""",
+                    (self.max_entries,))
+
+    def get_stats(self):
+        with self.lock:
+            entries = self.connect().execute('SELECT count(*) FROM entries').fetchone()[0]
+
+        return {
+            'backend': 'sqlite',
+            'entries': entries,
+            'hits': self.hits,
+            'misses': self.misses
+        }
+
+class DataVersion:
+    """Latest import stamp, looked up at most once every ttl seconds"""
+    def __init__(self, fetch, ttl):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.version = None
+        self.checked = 0
+        self.lock = threading.Lock()
+
+    def get(self):
+        with self.lock:
+            if time.time() - self.checked >= self.ttl:
+                self.version = self.fetch()
+                self.checked = time.time()
+
+            return self.version
+
+def get_cache(config):
+    backend = config.get('CACHE_BACKEND')
+    max_entries = config.get('CACHE_MAX_ENTRIES', 256)
+
+    if backend == 'memory':
+        return MemoryCache(max_entries)
+    if backend == 'sqlite':
+        return SqliteCache(config.get('CACHE_PATH', '/tmp/pavement-cache.sqlite'), max_entries)
+
+    return None
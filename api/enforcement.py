@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+import math
+from datetime import time, timezone
+
+off_hours_start = time(6, 0, tzinfo=timezone.utc) # 2am
+off_hours_end = time(13, 0, tzinfo=timezone.utc) # 9am
+
+day_seconds = 86400
+window_start = off_hours_start.hour * 3600 + off_hours_start.minute * 60 + off_hours_start.second
+window_length = off_hours_end.hour * 3600 + off_hours_end.minute * 60 + off_hours_end.second \
+    - window_start
+
+def get_enforceable_seconds(start_time, end_time):
+    # seconds in [start_time, end_time) outside the daily off-hours window,
+    # computed in constant time from how much off-hours time precedes each end
+    if end_time <= start_time:
+        return 0
+
+    start = start_time.timestamp()
+    end = end_time.timestamp()
+    seconds = (end - start) - (get_off_hours_before(end) - get_off_hours_before(start))
+
+    return int(math.ceil(seconds))
+
+def get_off_hours_before(timestamp):
+    # off-hours seconds between the epoch and timestamp; windows are fixed in
+    # UTC like off_hours_start/off_hours_end, so every day has the same one
+    days, seconds = divmod(timestamp, day_seconds)
+    return days * window_length + min(max(seconds - window_start, 0), window_length)
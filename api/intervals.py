@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+from array import array
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import BigInteger, cast, extract, func
+
+epoch = datetime(1970, 1, 1, tzinfo=timezone.utc)
+microsecond = timedelta(microseconds=1)
+
+def to_epoch(dt):
+    # whole microseconds, so differences divide back into the same seconds
+    # timedelta.total_seconds() gives
+    return (dt - epoch) // microsecond
+
+def to_seconds(microseconds):
+    return microseconds / 1000000
+
+def get_epoch_column(column):
+    return cast(func.round(extract('epoch', column) * 1000000), BigInteger)
+
+def to_epoch_rows(rows):
+    for id, start_time, end_time in rows:
+        yield id, to_epoch(start_time), None if end_time is None else to_epoch(end_time)
+
+class Intervals:
+    """One stall's [start, end) intervals as parallel int64 epoch arrays"""
+    __slots__ = ('starts', 'ends')
+
+    def __init__(self):
+        self.starts = array('q')
+        self.ends = array('q')
+
+    def __len__(self):
+        return len(self.starts)
+
+    def __iter__(self):
+        return zip(self.starts, self.ends)
+
+class IntervalStore:
+    """Intervals keyed by stall, in the order stalls were first seen"""
+    def __init__(self):
+        self.stalls = {}
+
+    def __contains__(self, stall):
+        return stall in self.stalls
+
+    def __getitem__(self, stall):
+        return self.stalls[stall]
+
+    def __len__(self):
+        return len(self.stalls)
+
+    def items(self):
+        return self.stalls.items()
+
+    def get_intervals(self, stall):
+        intervals = self.stalls.get(stall)
+        if intervals is None:
+            intervals = self.stalls[stall] = Intervals()
+        return intervals
+
+    def add(self, stall, start, end):
+        intervals = self.get_intervals(stall)
+        intervals.starts.append(start)
+        intervals.ends.append(end)
+
+    def add_squashed(self, stall, start, end):
+        # rows have to come in purchased_date order: a start inside the last
+        # interval moves up to its end and an interval it covers is dropped,
+        # so the arrays never hold an overlap
+        intervals = self.get_intervals(stall)
+        if intervals.ends:
+            last_end = intervals.ends[-1]
+            if end <= last_end:
+                return
+            if start < last_end:
+                start = last_end
+
+        intervals.starts.append(start)
+        intervals.ends.append(end)
+
+def get_keyed(rows, squash = False):
+    # (stall, start, end) epoch rows into a store, skipping rows without an end
+    store = IntervalStore()
+    add = store.add_squashed if squash else store.add
+
+    for id, start, end in rows:
+        if end is None:
+            continue
+        add(id, start, end)
+
+    return store
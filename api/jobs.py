@@ -0,0 +1,131 @@
+#!/usr/bin/env python3
+import os, sqlite3, threading, time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+class JobQueue:
+    """Requests run by a pool of threads, tracked in a local SQLite file
+
+    Every worker shares the file, so a job can be polled from any of them
+    while the one that accepted it runs it. run takes a job's request and
+    returns its (status code, body, mimetype), or None if it failed.
+    Finished jobs are kept for ttl seconds.
+    """
+    def __init__(self, run, path, workers, ttl):
+        self.run = run
+        self.path = path
+        self.workers = workers
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.connection = None
+        self.executor = None
+        self.pid = None
+
+    def connect(self):
+        # connections and threads don't survive a fork, so each worker opens its own
+        if self.connection is None or self.pid != os.getpid():
+            self.connection = sqlite3.connect(self.path, timeout=5, check_same_thread=False,
+                isolation_level=None)
+            self.connection.execute('PRAGMA journal_mode=WAL')
+            self.connection.execute("""CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY, endpoint TEXT, status TEXT, pid INTEGER,
+                submitted REAL, finished REAL, status_code INTEGER, body BLOB, mimetype TEXT)""")
+            self.executor = ThreadPoolExecutor(max_workers=self.workers)
+            self.pid = os.getpid()
+
+        return self.connection
+
+    def submit(self, id, endpoint, request):
+        # an identical job that hasn't finished yet, in any worker, is
+        # returned instead
+        with self.lock:
+            connection = self.connect()
+            connection.execute('BEGIN IMMEDIATE')
+            try:
+                self.expire(connection)
+                job = get_job(connection, id)
+                if job is None or job['status'] not in ('queued', 'running'):
+                    connection.execute('INSERT OR REPLACE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (id, endpoint, 'queued', os.getpid(), time.time(), None, None, None, None))
+                    job = get_job(connection, id)
+                    self.executor.submit(self.work, id, request)
+                connection.execute('COMMIT')
+            except BaseException:
+                connection.execute('ROLLBACK')
+                raise
+
+            return get_status(job)
+
+    def get(self, id):
+        # (status, (status code, body, mimetype) once finished), or None once
+        # the job has expired
+        with self.lock:
+            connection = self.connect()
+            self.expire(connection)
+            job = get_job(connection, id)
+            if job is None:
+                return None
+
+            response = None
+            if job['status'] == 'finished':
+                response = (job['status_code'], bytes(job['body']), job['mimetype'])
+            return get_status(job), response
+
+    def work(self, id, request):
+        with self.lock:
+            self.connect().execute("UPDATE jobs SET status = 'running' WHERE id = ?", (id,))
+
+        response = self.run(request)
+
+        with self.lock:
+            connection = self.connect()
+            if response is None:
+                connection.execute("""UPDATE jobs SET status = 'failed', finished = ?
+                    WHERE id = ?""", (time.time(), id))
+            else:
+                connection.execute("""UPDATE jobs SET status = 'finished', finished = ?,
+                    status_code = ?, body = ?, mimetype = ? WHERE id = ?""",
+                    (time.time(),) + response + (id,))
+
+    def expire(self, connection):
+        connection.execute('DELETE FROM jobs WHERE finished IS NOT NULL AND finished <= ?',
+            (time.time() - self.ttl,))
+
+def get_job(connection, id):
+    row = connection.execute("""SELECT id, endpoint, status, pid, submitted, finished,
+        status_code, body, mimetype FROM jobs WHERE id = ?""", (id,)).fetchone()
+    if row is None:
+        return None
+
+    job = dict(zip(('id', 'endpoint', 'status', 'pid', 'submitted', 'finished',
+        'status_code', 'body', 'mimetype'), row))
+    # a worker that exits takes its unfinished jobs with it
+    if job['finished'] is None and not is_running(job['pid']):
+        job['status'] = 'failed'
+        job['finished'] = time.time()
+        connection.execute("UPDATE jobs SET status = 'failed', finished = ? WHERE id = ?",
+            (job['finished'], id))
+    return job
+
+def is_running(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+def get_status(job):
+    return {
+        'id': job['id'],
+        'endpoint': job['endpoint'],
+        'status': job['status'],
+        'submitted': to_iso(job['submitted']),
+        'finished': to_iso(job['finished'])
+    }
+
+def to_iso(timestamp):
+    if timestamp is None:
+        return None
+    return datetime.fromtimestamp(timestamp, timezone.utc).isoformat()
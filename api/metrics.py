@@ -0,0 +1,178 @@
+#!/usr/bin/env python3
+import bisect, collections, threading
+from flask import g, has_request_context, request
+from timeit import default_timer as timer
+
+# seconds, Prometheus' default latency buckets
+buckets = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+enabled = False
+
+class Metrics:
+    """Latency histograms, phase totals and row counts for one process"""
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = {}
+        self.phases = collections.defaultdict(float)
+        self.rows = collections.Counter()
+
+    def observe(self, endpoint, seconds, phases, rows):
+        with self.lock:
+            histogram = self.latencies.get(endpoint)
+            if histogram is None:
+                histogram = self.latencies[endpoint] = {
+                    'buckets': [0] * len(buckets), 'sum': 0, 'count': 0}
+
+            i = bisect.bisect_left(buckets, seconds)
+            if i < len(buckets):
+                histogram['buckets'][i] += 1
+            histogram['sum'] += seconds
+            histogram['count'] += 1
+
+            for name, phase_seconds in phases.items():
+                self.phases[(endpoint, name)] += phase_seconds
+            self.rows[endpoint] += rows
+
+    def render(self, cache_stats = None):
+        # Prometheus text exposition format, version 0.0.4
+        lines = [
+            '# HELP pavement_request_duration_seconds Time until the response headers were ready.',
+            '# TYPE pavement_request_duration_seconds histogram'
+        ]
+
+        with self.lock:
+            for endpoint, histogram in sorted(self.latencies.items()):
+                label = 'endpoint="' + endpoint + '"'
+                count = 0
+                for le, bucket in zip(buckets, histogram['buckets']):
+                    count += bucket
+                    lines.append('pavement_request_duration_seconds_bucket{' + label
+                        + ',le="' + str(le) + '"} ' + str(count))
+                lines.append('pavement_request_duration_seconds_bucket{' + label + ',le="+Inf"} '
+                    + str(histogram['count']))
+                lines.append('pavement_request_duration_seconds_sum{' + label + '} '
+                    + repr(histogram['sum']))
+                lines.append('pavement_request_duration_seconds_count{' + label + '} '
+                    + str(histogram['count']))
+
+            lines += [
+                '# HELP pavement_request_phase_seconds_total Time spent in each phase of a request.',
+                '# TYPE pavement_request_phase_seconds_total counter'
+            ]
+            for (endpoint, name), seconds in sorted(self.phases.items()):
+                lines.append('pavement_request_phase_seconds_total{endpoint="' + endpoint
+                    + '",phase="' + name + '"} ' + repr(seconds))
+
+            lines += [
+                '# HELP pavement_rows_fetched_total Transaction rows read from the database.',
+                '# TYPE pavement_rows_fetched_total counter'
+            ]
+            for endpoint, rows in sorted(self.rows.items()):
+                lines.append('pavement_rows_fetched_total{endpoint="' + endpoint + '"} ' + str(rows))
+
+        if cache_stats is not None:
+            label = '{backend="' + cache_stats['backend'] + '"} '
+            lines += [
+                '# HELP pavement_cache_entries Responses held in the result cache.',
+                '# TYPE pavement_cache_entries gauge',
+                'pavement_cache_entries' + label + str(cache_stats['entries']),
+                '# HELP pavement_cache_hits_total Requests answered from the result cache.',
+                '# TYPE pavement_cache_hits_total counter',
+                'pavement_cache_hits_total' + label + str(cache_stats['hits']),
+                '# HELP pavement_cache_misses_total Requests the result cache could not answer.',
+                '# TYPE pavement_cache_misses_total counter',
+                'pavement_cache_misses_total' + label + str(cache_stats['misses'])
+            ]
+
+        return '\n'.join(lines) + '\n'
+
+class Phase:
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.db = g.metrics_db
+        self.started = timer()
+
+    def __exit__(self, *exc):
+        elapsed = timer() - self.started
+        if self.name == 'db':
+            g.metrics_db += elapsed
+        else:
+            # time spent waiting on the database is reported as db on its own
+            g.metrics_phases[self.name] = g.metrics_phases.get(self.name, 0) \
+                + elapsed - (g.metrics_db - self.db)
+
+class NullPhase:
+    def __enter__(self):
+        pass
+
+    def __exit__(self, *exc):
+        pass
+
+null_phase = NullPhase()
+metrics = Metrics()
+
+def init_app(app):
+    # nothing is hooked in unless METRICS_ENABLED is set, so phase() and
+    # timed_rows() fall straight through
+    global enabled
+    enabled = bool(app.config.get('METRICS_ENABLED', False))
+    if not enabled:
+        return
+
+    app.before_request(start_request)
+    app.after_request(finish_request)
+
+def is_recording():
+    return enabled and has_request_context() and 'metrics_phases' in g
+
+def phase(name):
+    if not is_recording():
+        return null_phase
+    return Phase(name)
+
+def timed_rows(rows):
+    if not is_recording():
+        return rows
+    return generate_timed_rows(iter(rows))
+
+def generate_timed_rows(rows):
+    # rows arrive lazily from a server-side cursor, so the database's share
+    # is the time spent waiting for each next row
+    while True:
+        started = timer()
+        try:
+            row = next(rows)
+        except StopIteration:
+            g.metrics_db += timer() - started
+            return
+        g.metrics_db += timer() - started
+        g.metrics_rows += 1
+        yield row
+
+def start_request():
+    g.metrics_started = timer()
+    g.metrics_phases = collections.OrderedDict()
+    g.metrics_db = 0
+    g.metrics_rows = 0
+
+def finish_request(response):
+    if 'metrics_phases' not in g or request.url_rule is None:
+        return response
+
+    phases = collections.OrderedDict()
+    if g.metrics_db:
+        phases['db'] = g.metrics_db
+    phases.update(g.metrics_phases)
+    total = timer() - g.metrics_started
+
+    # streamed bodies are written after this, so their phases stop at the headers
+    response.headers['Server-Timing'] = ', '.join(
+        name + ';dur=' + '{:.1f}'.format(seconds * 1000)
+        for name, seconds in list(phases.items()) + [('total', total)])
+
+    if request.url_rule.rule != '/metrics':
+        metrics.observe(request.url_rule.rule, total, phases, g.metrics_rows)
+
+    return response
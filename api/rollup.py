@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+from datetime import timedelta
+from sqlalchemy import func
+from api import tables
+
+ApHourlyRollup = tables.ApHourlyRollup
+one_hour = timedelta(hours=1)
+# the stall rows without one are rolled up under (see ap_rollup.py)
+no_stall = ''
+
+def get_hours(datetime_range):
+    # the whole hours inside datetime_range, or False when there are none
+    hours = {
+        'start': ceil_hour(datetime_range['start']),
+        'end': floor_hour(datetime_range['end'])
+    }
+
+    if hours['end'] <= hours['start']:
+        return False
+
+    return hours
+
+def is_aligned(dt):
+    return dt.timestamp() % 3600 == 0
+
+def floor_hour(dt):
+    return dt - timedelta(seconds=dt.timestamp() % 3600)
+
+def ceil_hour(dt):
+    return dt if is_aligned(dt) else floor_hour(dt) + one_hour
+
+def get_filters(hours, spaces):
+    filters = [
+        hours['start'] <= ApHourlyRollup.hour,
+        hours['end'] > ApHourlyRollup.hour
+    ]
+
+    if spaces is not None:
+        # no requested space matches the rows without a stall
+        filters.append(ApHourlyRollup.stall.in_([space for space in spaces if space != no_stall]))
+
+    return filters
+
+def get_occupied_seconds(hours, spaces):
+    return ApHourlyRollup.query.with_entities(
+        ApHourlyRollup.hour, func.sum(ApHourlyRollup.occupied_seconds)
+        ).filter(*get_filters(hours, spaces)).group_by(ApHourlyRollup.hour).all()
+
+def get_purchases(hours, spaces):
+    return ApHourlyRollup.query.with_entities(
+        ApHourlyRollup.hour, func.sum(ApHourlyRollup.revenue),
+        func.sum(ApHourlyRollup.transaction_count), func.sum(ApHourlyRollup.paid_seconds)
+        ).filter(*get_filters(hours, spaces)).group_by(ApHourlyRollup.hour).all()
+
+def get_stall_revenue(hours, spaces):
+    # keyed by None for the rows without a stall, as the raw rows group them
+    rows = ApHourlyRollup.query.with_entities(
+        ApHourlyRollup.stall, func.sum(ApHourlyRollup.revenue)
+        ).filter(ApHourlyRollup.revenue.isnot(None), *get_filters(hours, spaces)
+        ).group_by(ApHourlyRollup.stall).all()
+
+    return [(None if stall == no_stall else stall, revenue) for stall, revenue in rows]
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+import math
+import numpy as np
+
+# quantiles come back within 1% of a stay that was actually seen
+relative_accuracy = 0.01
+# stays under a second count as 0 and longer ones than a month as a month,
+# which bounds a sketch to `bins` counts however many stays go in
+min_seconds = 1
+max_seconds = 31 * 86400
+
+gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+log_gamma = math.log(gamma)
+bins = int(math.ceil(math.log(max_seconds) / log_gamma)) + 1
+
+class Sketch:
+    """Stay lengths as counts per logarithmically sized bin (a DDSketch).
+
+    Bin i holds the stays in (gamma^(i-1), gamma^i] seconds, so two sketches
+    merge exactly by adding their counts.
+    """
+    __slots__ = ('counts', 'zero', 'count')
+
+    def __init__(self):
+        self.counts = {}
+        self.zero = 0
+        self.count = 0
+
+    def add(self, seconds):
+        add_grouped([self], np.zeros(len(seconds), dtype=np.int64), seconds)
+
+    def merge(self, other):
+        for index, count in other.counts.items():
+            self.counts[index] = self.counts.get(index, 0) + count
+        self.zero += other.zero
+        self.count += other.count
+        return self
+
+    def quantile(self, q):
+        # seconds, 0 when the sketch is empty like the means alongside it
+        if not self.count:
+            return 0
+
+        rank = q * (self.count - 1)
+        seen = self.zero
+        if rank < seen:
+            return 0
+
+        for index in sorted(self.counts):
+            seen += self.counts[index]
+            if rank < seen:
+                return 2 * gamma ** index / (gamma + 1)
+
+        return 2 * gamma ** max(self.counts) / (gamma + 1)
+
+def get_indexes(seconds):
+    return np.ceil(np.log(np.minimum(seconds, max_seconds)) / log_gamma).astype(np.int64)
+
+def add_grouped(sketches, keys, seconds):
+    # adds seconds[i] to sketches[keys[i]] for whole arrays at once
+    seconds = np.asarray(seconds, dtype=np.float64)
+    keys = np.asarray(keys, dtype=np.int64)
+    positive = seconds >= min_seconds
+    totals = np.bincount(keys, minlength=len(sketches))
+    zeros = np.bincount(keys[~positive], minlength=len(sketches))
+
+    combined = keys[positive] * bins + get_indexes(seconds[positive])
+    values, counts = np.unique(combined, return_counts=True)
+    for value, count in zip(values.tolist(), counts.tolist()):
+        sketch = sketches[value // bins]
+        index = value % bins
+        sketch.counts[index] = sketch.counts.get(index, 0) + count
+
+    for sketch, total, zero in zip(sketches, totals.tolist(), zeros.tolist()):
+        sketch.count += total
+        sketch.zero += zero
+
+def from_stays(starts, ends):
+    # int64 epoch microsecond arrays, like an intervals.Intervals
+    stays = np.frombuffer(ends, dtype=np.int64) - np.frombuffer(starts, dtype=np.int64)
+    stay_sketch = Sketch()
+    stay_sketch.add(stays / 1000000)
+    return stay_sketch
+
+def merge(sketches):
+    merged = Sketch()
+    for sketch in sketches:
+        merged.merge(sketch)
+    return merged
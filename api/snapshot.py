@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+import json, os, threading
+import numpy as np
+from decimal import Decimal
+from api import bucketing
+
+# matches column_types and missing in ap_snapshot.py
+missing = np.iinfo(np.int64).min
+columns = ('stall', 'purchased', 'expiry', 'revenue', 'parking_day')
+chunk_size = 65536
+
+class Snapshot:
+    """The importer's latest columnar export, memory-mapped read-only.
+
+    Every worker maps the same files, so they share one copy of the pages
+    through the page cache. A new export is picked up on the next request
+    after path/current moves to it.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.target = None
+        self.data = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        # None until the importer has exported one
+        link = os.path.join(self.path, 'current')
+        if not self.path or not os.path.lexists(link):
+            return None
+
+        target = os.path.realpath(link)
+        with self.lock:
+            if target != self.target:
+                self.data = load(target)
+                self.target = target
+
+            return self.data
+
+class SnapshotData:
+    def __init__(self, stalls, offsets, **arrays):
+        self.stalls = stalls
+        self.codes = {stall: code for code, stall in enumerate(stalls)}
+        self.offsets = offsets
+
+        for column in columns:
+            setattr(self, column, arrays[column])
+
+def load(directory):
+    with open(os.path.join(directory, 'stalls.json')) as f:
+        stalls = json.load(f)
+
+    return SnapshotData(stalls, np.load(os.path.join(directory, 'offsets.npy')),
+        **{column: np.load(os.path.join(directory, column + '.npy'), mmap_mode='r')
+            for column in columns})
+
+def from_rows(rows):
+    # SnapshotData in memory for (stall, purchased, expiry, revenue, parking_day)
+    # rows in any order, with epoch microseconds and cents as in the export.
+    # rows can come straight off a server-side cursor, so only one chunk of
+    # them is held as Python objects at a time
+    codes = {}
+    chunks = {column: [] for column in columns}
+
+    for chunk in bucketing.get_chunks(rows):
+        count = len(chunk)
+        stalls, starts, ends, revenues, parking_days = zip(*chunk)
+        chunks['stall'].append(np.fromiter((codes.setdefault(stall, len(codes))
+            for stall in stalls), dtype=np.int32, count=count))
+        chunks['purchased'].append(np.fromiter(starts, dtype=np.int64, count=count))
+        chunks['expiry'].append(np.fromiter((missing if end is None else end
+            for end in ends), dtype=np.int64, count=count))
+        chunks['revenue'].append(np.fromiter((missing if revenue is None else revenue
+            for revenue in revenues), dtype=np.int64, count=count))
+        chunks['parking_day'].append(np.fromiter((-1 if day is None else day
+            for day in parking_days), dtype=np.int64, count=count))
+
+    arrays = {column: np.concatenate(values) if values
+        else np.zeros(0, dtype=np.int32 if column == 'stall' else np.int64)
+        for column, values in chunks.items()}
+    # same order as the export, so offsets slices out each stall
+    order = np.lexsort((arrays['purchased'], arrays['stall']))
+    for column in columns:
+        arrays[column] = arrays[column][order]
+    offsets = np.searchsorted(arrays['stall'], np.arange(len(codes) + 1))
+
+    return SnapshotData(list(codes), offsets, **arrays)
+
+def select(data, spaces, epoch_range, only_check_start = False, day = False, earliest = None):
+    # row numbers get_filters in api/api.py would return, in purchased_date order
+    if spaces is None:
+        index = None
+        purchased = data.purchased
+    else:
+        codes = sorted(data.codes[space] for space in set(spaces) if space in data.codes)
+        index = np.concatenate([np.arange(data.offsets[code], data.offsets[code + 1])
+            for code in codes] or [np.zeros(0, dtype=np.int64)])
+        purchased = data.purchased[index]
+
+    if only_check_start:
+        mask = (purchased >= epoch_range['start']) & (purchased < epoch_range['end'])
+    else:
+        expiry = data.expiry if index is None else data.expiry[index]
+        # a missing expiry is the smallest int64, so it never passes
+        mask = (expiry > epoch_range['start']) & (purchased < epoch_range['end'])
+        if earliest is not None:
+            mask &= purchased > earliest
+
+    if day is not False:
+        parking_day = data.parking_day if index is None else data.parking_day[index]
+        mask &= parking_day == day
+
+    rows = np.flatnonzero(mask) if index is None else index[mask]
+    return rows[np.argsort(data.purchased[rows], kind='mergesort')]
+
+def get_rows(data, rows):
+    # (stall, purchased, expiry) in epoch microseconds, like get_epoch_columns
+    stalls = data.stalls
+    for i in range(0, len(rows), chunk_size):
+        chunk = rows[i:i + chunk_size]
+        for code, start, end in zip(data.stall[chunk].tolist(), data.purchased[chunk].tolist(),
+            data.expiry[chunk].tolist()):
+            yield stalls[code], start, None if end == missing else end
+
+def get_revenue(data, rows):
+    # seconds, stall codes and cents of the on-hours purchases with revenue
+    revenue = data.revenue[rows]
+    seconds = data.purchased[rows] / 1000000
+    keep = (revenue != missing) & bucketing.on_hours_mask(seconds)
+    return seconds[keep], data.stall[rows][keep], revenue[keep]
+
+def get_revenue_sum(data, rows):
+    # {stall: revenue} as aggregates.get_revenue_sum returns it
+    seconds, codes, cents = get_revenue(data, rows)
+    counts = np.bincount(codes, minlength=len(data.stalls))
+    # float64 sums of whole cents stay exact well past any real revenue total
+    totals = np.rint(np.bincount(codes, weights=cents, minlength=len(data.stalls)))
+
+    return {data.stalls[code]: Decimal(int(totals[code])).scaleb(-2)
+        for code in np.flatnonzero(counts).tolist()}
+
+def get_bucketed_revenue(data, rows, time_intervals):
+    # as aggregates.get_bucketed_revenue, including purchases after the last
+    # boundary landing in the last bucket
+    seconds, codes, cents = get_revenue(data, rows)
+    length = len(time_intervals)
+    indexes = bucketing.get_bucket_indexes(seconds, bucketing.to_epochs(time_intervals))
+    keep = indexes >= 0
+    counts = np.bincount(indexes[keep], minlength=length)
+    totals = np.rint(np.bincount(indexes[keep], weights=cents[keep], minlength=length))
+
+    return [Decimal(int(total)).scaleb(-2) if count else 0
+        for total, count in zip(totals.tolist(), counts.tolist())]
@@ -0,0 +1,47 @@
+#!/usr/bin/env python3
+import bisect, threading
+from api import tables
+
+class StallInventory:
+    """ap_stalls held in memory, reloaded whenever the data version changes"""
+    def __init__(self, data_version):
+        self.data_version = data_version
+        self.version = None
+        self.snapshot = None
+        self.lock = threading.Lock()
+
+    def get_snapshot(self):
+        version = self.data_version.get()
+        with self.lock:
+            if self.snapshot is None or version != self.version:
+                self.snapshot = load()
+                self.version = version
+
+            return self.snapshot
+
+    def get_listing(self):
+        return self.get_snapshot()['listing']
+
+    def count(self):
+        return len(self.get_snapshot()['listing'])
+
+    def count_active(self, start, end):
+        # stalls seen at some point in [start, end); none can be first seen
+        # after end and last seen before start, so the two sorted lists give
+        # the count without touching each stall
+        snapshot = self.get_snapshot()
+        return bisect.bisect_left(snapshot['first_seen'], end) \
+            - bisect.bisect_left(snapshot['last_seen'], start)
+
+def load():
+    stalls = tables.ApStalls.query.order_by(tables.ApStalls.stall).all()
+    return {
+        'listing': [{
+            'space': stall.stall,
+            'zone': stall.zone,
+            'first_seen': stall.first_seen,
+            'last_seen': stall.last_seen
+            } for stall in stalls],
+        'first_seen': sorted(stall.first_seen for stall in stalls),
+        'last_seen': sorted(stall.last_seen for stall in stalls)
+    }
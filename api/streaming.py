@@ -0,0 +1,63 @@
+#!/usr/bin/env python3
+from flask import current_app, g, json, jsonify, request, stream_with_context
+from api import metrics
+
+chunk_size = 65536
+
+def respond(body):
+    # a dict body as a normal jsonify response; anything else is the items of
+    # {'data': items}, written out as they are produced when streaming is requested
+    if isinstance(body, dict) or not is_streaming():
+        with metrics.phase('json'):
+            return jsonify(get_body(body))
+
+    return current_app.response_class(
+        stream_with_context(generate(body)),
+        mimetype=current_app.config['JSONIFY_MIMETYPE'])
+
+def get_body(body):
+    # what respond would return, for nesting in another body
+    if isinstance(body, dict):
+        return body
+    return {'data': list(body)}
+
+def is_streaming():
+    # a job keeps the whole body to hand out later
+    if g.get('buffered', False):
+        return False
+
+    return request.args.get('stream', default = False) \
+        or current_app.config.get('STREAM_RESPONSES', False)
+
+def generate(items):
+    # byte for byte what jsonify({'data': [...]}) returns, pretty printed or not
+    pretty = current_app.config['JSONIFY_PRETTYPRINT_REGULAR'] and not request.is_xhr
+    if pretty:
+        start, item_start, separator = '{\n  "data": [', '\n    ', ', '
+        end, empty_end = '\n  ]\n}\n', ']\n}\n'
+    else:
+        start, item_start, separator = '{"data":[', '', ','
+        end, empty_end = ']}\n', ']}\n'
+
+    chunk = [start]
+    size = len(start)
+    first = True
+
+    for item in items:
+        if pretty:
+            encoded = json.dumps(item, indent=2, separators=(', ', ': ')).replace('\n', '\n    ')
+        else:
+            encoded = json.dumps(item, separators=(',', ':'))
+
+        encoded = ('' if first else separator) + item_start + encoded
+        first = False
+        chunk.append(encoded)
+        size += len(encoded)
+
+        if size >= chunk_size:
+            yield ''.join(chunk)
+            chunk = []
+            size = 0
+
+    chunk.append(empty_end if first else end)
+    yield ''.join(chunk)
@@ -50,3 +50,19 @@ class ApTransactions(Table, db.Model):
     card_type = db.Column(db.VARCHAR(length=50))
     method = db.Column(db.VARCHAR(length=50))
     parking_day = db.Column(db.SMALLINT)
+
+class ApHourlyRollup(Table, db.Model):
+    __tablename__ = 'ap_hourly_rollup'
+    stall = db.Column(db.VARCHAR(length=50), primary_key=True)
+    hour = db.Column(db.TIMESTAMP, primary_key=True)
+    occupied_seconds = db.Column(db.Float)
+    revenue = db.Column(db.DECIMAL(precision=12, scale=2))
+    transaction_count = db.Column(db.Integer)
+    paid_seconds = db.Column(db.Float)
+
+class ApStalls(Table, db.Model):
+    __tablename__ = 'ap_stalls'
+    stall = db.Column(db.VARCHAR(length=50), primary_key=True)
+    zone = db.Column(db.VARCHAR(length=50))
+    first_seen = db.Column(db.TIMESTAMP, nullable=False)
+    last_seen = db.Column(db.TIMESTAMP, nullable=False)
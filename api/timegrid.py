@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+import functools, pytz
+import numpy as np
+from datetime import time, timedelta, timezone
+from api import enforcement, intervals
+
+new_york = pytz.timezone('America/New_York')
+midnight = time(4, 0, tzinfo=timezone.utc)
+# grids are kept as int32 step numbers, about 100kB for three years of hours;
+# the datetimes themselves would take twenty times that, so they are built
+# again on every call
+cache_size = 256
+
+day_microseconds = 86400 * 1000000
+minute_microseconds = 60 * 1000000
+
+# pytz's own table, so offsets match the ones astimezone picks
+transitions = np.array([intervals.to_epoch(t.replace(tzinfo=timezone.utc))
+    for t in new_york._utc_transition_times], dtype=np.int64)
+transition_offsets = np.array([info[0] // intervals.microsecond
+    for info in new_york._transition_info], dtype=np.int64)
+transition_tzinfos = [new_york._tzinfos[info] for info in new_york._transition_info]
+
+def to_key(t):
+    # an aware time in microseconds as time comparisons see it: the local time
+    # of day less the whole minutes of its offset, without wrapping past midnight
+    minutes = t.hour * 60 + t.minute - t.utcoffset() // timedelta(minutes=1)
+    return (minutes * 60 + t.second) * 1000000 + t.microsecond
+
+midnight_key = to_key(midnight)
+off_hours_start_key = to_key(enforcement.off_hours_start)
+off_hours_end_key = to_key(enforcement.off_hours_end)
+
+def get_times(start, end, delta, include_end, parking_day):
+    # 0 is monday, and False == 0 as a cache key
+    steps, add_end = get_cached_times(start, get_zone(start), end, get_zone(end), delta,
+        include_end, None if parking_day is False else parking_day)
+    times = to_times(start, delta, steps)
+    if add_end:
+        times.append(end)
+
+    return times
+
+def get_week(start, end, include_end):
+    # {parking_day: (times, local_times)} of the hourly boundaries
+    delta = timedelta(hours=1)
+    week = get_cached_week(start, get_zone(start), end, get_zone(end), include_end)
+
+    return {day: (to_times(start, delta, steps), to_local_times(start, delta, steps))
+        for day, steps in week.items()}
+
+def get_zone(dt):
+    # datetimes compare by instant, so their zones are part of the cache key:
+    # they are what the boundaries come back in and decide which day each
+    # falls on. dateutil's tzoffset can't be hashed itself
+    return repr(dt.tzinfo), dt.utcoffset()
+
+@functools.lru_cache(maxsize=cache_size)
+def get_cached_times(start, start_zone, end, end_zone, delta, include_end, parking_day):
+    # the steps to keep, and whether end goes after them
+    epochs, offset = get_steps(start, end, delta, include_end)
+    keys = get_keys(epochs, offset)
+    keep = on_hours_mask(keys)
+    if parking_day is not None:
+        keep &= get_parking_days(epochs, keys) == parking_day
+    steps = np.flatnonzero(keep).astype(np.int32)
+
+    # no times at all still raises an IndexError here
+    if include_end and epochs[steps[-1]] != intervals.to_epoch(end):
+        if parking_day is None:
+            return steps, True
+        steps = np.append(steps, steps[-1] + 1)
+
+    return steps, False
+
+@functools.lru_cache(maxsize=cache_size)
+def get_cached_week(start, start_zone, end, end_zone, include_end):
+    epochs, offset = get_steps(start, end, timedelta(hours=1), include_end)
+    keys = get_keys(epochs, offset)
+    on_hours = on_hours_mask(keys)
+    parking_days = get_parking_days(epochs, keys)
+    week = {}
+
+    for day in range(7):
+        steps = np.flatnonzero(on_hours & (parking_days == day)).astype(np.int32)
+        if include_end and len(steps) and epochs[steps[-1]] != intervals.to_epoch(end):
+            steps = np.append(steps, steps[-1] + 1)
+        week[day] = steps
+
+    return week
+
+def get_steps(start, end, delta, include_end):
+    # epochs in microseconds of start, start + delta, ... up to end, and the
+    # UTC offset they share. Only fixed offsets have a timetz() that compares
+    # with the off hours, and any other tzinfo still fails here with a TypeError
+    offset = start.timetz().utcoffset() // intervals.microsecond
+    step = delta // intervals.microsecond
+    span = intervals.to_epoch(end) - intervals.to_epoch(start)
+    count = max(span // step + 1 if include_end else -(-span // step), 0)
+
+    return intervals.to_epoch(start) + np.arange(count, dtype=np.int64) * step, offset
+
+def to_times(start, delta, steps):
+    return [start + delta * step for step in steps.tolist()]
+
+def to_local_times(start, delta, steps):
+    # what astimezone(new_york) gives for each time, which is pytz's fromutc:
+    # the UTC time plus its transition's offset, carrying that transition's tzinfo
+    index = get_transitions(intervals.to_epoch(start)
+        + steps.astype(np.int64) * (delta // intervals.microsecond))
+    utc = start.astimezone(timezone.utc).replace(tzinfo=None)
+    bases = {i: (utc + new_york._transition_info[i][0]).replace(tzinfo=transition_tzinfos[i])
+        for i in set(index.tolist())}
+
+    return [bases[i] + delta * step for step, i in zip(steps.tolist(), index.tolist())]
+
+def get_keys(epochs, offset):
+    # to_key of each boundary's timetz()
+    return (epochs + offset) % day_microseconds - offset // minute_microseconds * minute_microseconds
+
+def on_hours_mask(keys):
+    return (keys < off_hours_start_key) | (keys >= off_hours_end_key)
+
+def get_transitions(epochs):
+    return np.maximum(np.searchsorted(transitions, epochs, side='right') - 1, 0)
+
+def get_parking_days(epochs, keys):
+    # weekday in New York, except that boundaries after local midnight count
+    # toward the day before until enforcement ends
+    local_days = (epochs + transition_offsets[get_transitions(epochs)]) // day_microseconds
+    weekdays = (local_days + 3) % 7 # 1970-01-01 was a thursday
+    early = (keys >= midnight_key) & (keys < off_hours_start_key)
+    return np.where(early, (weekdays - 1) % 7, weekdays)
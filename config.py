@@ -7,6 +7,29 @@ class Config(object):
     TESTING = False
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_DATABASE_URI = os.getenv('DATABASE_URI')
+    USE_HOURLY_ROLLUP = os.getenv('USE_HOURLY_ROLLUP', '1') == '1'
+    CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory') # memory, sqlite or none
+    CACHE_MAX_ENTRIES = int(os.getenv('CACHE_MAX_ENTRIES', 256))
+    CACHE_PATH = os.getenv('CACHE_PATH', '/tmp/pavement-cache.sqlite')
+    CACHE_VERSION_TTL = int(os.getenv('CACHE_VERSION_TTL', 30))
+    STREAM_RESPONSES = os.getenv('STREAM_RESPONSES', '0') == '1'
+    QUERY_CHUNK_SIZE = int(os.getenv('QUERY_CHUNK_SIZE', 10000))
+    # longest transaction occupancy queries look back for; bounds
+    # purchased_date so monthly partitions can be pruned. The importer cuts
+    # longer sessions to it (Import.max_transaction_days), but any loaded
+    # before it did are left out of occupancy on the SQL and snapshot backends
+    MAX_TRANSACTION_DAYS = int(os.getenv('MAX_TRANSACTION_DAYS', 31))
+    # Server-Timing headers and /metrics; off skips the hooks entirely
+    METRICS_ENABLED = os.getenv('METRICS_ENABLED', '1') == '1'
+    # 'snapshot' reads transactions from the importer's memory-mapped export
+    # in SNAPSHOT_PATH, falling back to PostgreSQL until one exists
+    ANALYTICS_BACKEND = os.getenv('ANALYTICS_BACKEND', 'sql') # sql or snapshot
+    SNAPSHOT_PATH = os.getenv('SNAPSHOT_PATH', '')
+    # /jobs/<route>: the SQLite file every worker tracks jobs in, threads per
+    # process running submitted requests, and seconds a finished job's result is kept
+    JOB_PATH = os.getenv('JOB_PATH', '/tmp/pavement-jobs.sqlite')
+    JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))
+    JOB_RESULT_TTL = int(os.getenv('JOB_RESULT_TTL', 600))
 
 class LocalConfig(Config):
     DEBUG = True
@@ -22,6 +45,34 @@ class Db:
     pw = os.getenv('DB_PASS')
     name = os.getenv('DB_NAME')
 
+class Import:
+    batch_size = int(os.getenv('IMPORT_BATCH_SIZE', 10000))
+    retries = int(os.getenv('IMPORT_RETRIES', 3))
+    # expiry_date is cut to purchased_date plus this many days; keep it equal
+    # to Config.MAX_TRANSACTION_DAYS
+    max_transaction_days = int(os.getenv('MAX_TRANSACTION_DAYS', 31))
+    # columnar export for ANALYTICS_BACKEND = 'snapshot'; empty skips it
+    snapshot_path = os.getenv('SNAPSHOT_PATH', '')
+    # ADAPTER:GLOB pairs (see ap_adapters.py) loaded in order; ap_importer.py
+    # --source replaces them
+    sources = [
+        'its_2016:AP Revenue - * 2016.csv',
+        'app:2017_App_Transaction_Report.csv',
+        'ips:2017_IPSGroup_Transaction_Report.csv',
+        'its:2017_ITS*.csv',
+        'app:2018_App_Transaction_Report_Jan-April.csv',
+        'ips:IPS_Transactions_Jan-Apr2018.csv',
+        'its:ITS Transactions 2018.csv'
+    ]
+    # for ap_importer.py --watch: ADAPTER:GLOB pairs inside the watched
+    # directory, seconds between looks, and seconds a file has to sit unchanged
+    watch_sources = ['app:*App_Transaction*.csv', 'ips:*IPS*.csv', 'its:*ITS*.csv']
+    watch_interval = int(os.getenv('IMPORT_WATCH_INTERVAL', 60))
+    watch_settle = int(os.getenv('IMPORT_WATCH_SETTLE', 30))
+    # with snapshot_path set, the least seconds between publishing what --watch
+    # loaded, since each publish exports the whole table
+    watch_snapshot_interval = int(os.getenv('IMPORT_WATCH_SNAPSHOT_INTERVAL', 900))
+
 class DbRead:
     host = ''
     user = ''
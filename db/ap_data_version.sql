@@ -0,0 +1,6 @@
+-- one row per import that changed ap_transactions; the API drops cached
+-- results whenever the latest version moves
+CREATE TABLE IF NOT EXISTS ap_data_version (
+    version SERIAL PRIMARY KEY,
+    imported_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+  );
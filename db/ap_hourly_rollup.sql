@@ -0,0 +1,22 @@
+-- per stall and hour totals kept up to date by ap_importer.py
+--   occupied_seconds: overlap of the stall's squashed transactions with the hour
+--   revenue, transaction_count, paid_seconds: transactions purchased in the
+--     hour outside the 2am-9am off-hours window, like the API's bucketing
+-- hours are truncated in UTC, which lines up with New York hours; transactions
+-- without a stall are kept under stall ''
+CREATE TABLE IF NOT EXISTS ap_hourly_rollup (
+    stall VARCHAR(50) NOT NULL,
+    hour TIMESTAMP WITH TIME ZONE NOT NULL,
+    occupied_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+    revenue DECIMAL(12,2),
+    transaction_count INT NOT NULL DEFAULT 0,
+    paid_seconds DOUBLE PRECISION NOT NULL DEFAULT 0,
+    PRIMARY KEY (stall, hour)
+  );
+
+CREATE INDEX IF NOT EXISTS ap_hourly_rollup_hour ON ap_hourly_rollup (hour);
+
+-- highest ap_transactions id already folded into the rollup
+CREATE TABLE IF NOT EXISTS ap_hourly_rollup_watermark (
+    last_id INT NOT NULL
+  );
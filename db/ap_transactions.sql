@@ -28,6 +28,16 @@ CREATE TABLE IF NOT EXISTS ap_transactions (
     validation_revenue DECIMAL(10,2),
     transaction_fee DECIMAL(10,2),
     card_type VARCHAR(50),
-    method VARCHAR(50)
+    method VARCHAR(50),
     parking_day SMALLINT
   );
+
+-- natural key used by the importer to drop rows it has already loaded
+CREATE UNIQUE INDEX IF NOT EXISTS ap_transactions_natural_key ON ap_transactions (
+    method,
+    COALESCE(ticket, -1),
+    COALESCE(passport_tran, -1),
+    COALESCE(merchant_tran, -1),
+    COALESCE(stall, ''),
+    purchased_date
+  );
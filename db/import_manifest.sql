@@ -0,0 +1,8 @@
+CREATE TABLE IF NOT EXISTS import_manifest (
+    file VARCHAR(255) PRIMARY KEY,
+    file_hash CHAR(64) NOT NULL,
+    file_size BIGINT NOT NULL,
+    row_count INT,
+    imported_offset INT NOT NULL DEFAULT 0,
+    imported_at TIMESTAMP WITH TIME ZONE
+  );
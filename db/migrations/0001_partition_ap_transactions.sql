@@ -0,0 +1,66 @@
+-- Monthly range partitions on purchased_date (PostgreSQL 11+), plus the
+-- indexes behind get_filters in api/api.py. Months are New York months.
+-- After applying, `./migrate.py --check-plans` prints how many partitions
+-- each endpoint's query shape still scans.
+
+ALTER TABLE ap_transactions RENAME TO ap_transactions_unpartitioned;
+ALTER SEQUENCE ap_transactions_id_seq OWNED BY NONE;
+
+CREATE TABLE ap_transactions (
+    LIKE ap_transactions_unpartitioned INCLUDING DEFAULTS,
+    PRIMARY KEY (id, purchased_date)
+  ) PARTITION BY RANGE (purchased_date);
+
+ALTER SEQUENCE ap_transactions_id_seq OWNED BY ap_transactions.id;
+
+-- unique indexes with expressions can't live on the partitioned table, so
+-- every partition gets its own copy of the natural key
+CREATE OR REPLACE FUNCTION create_ap_transactions_natural_key(partition TEXT) RETURNS VOID AS $$
+BEGIN
+    EXECUTE format('CREATE UNIQUE INDEX IF NOT EXISTS %I ON %I (method, COALESCE(ticket, -1),
+        COALESCE(passport_tran, -1), COALESCE(merchant_tran, -1), COALESCE(stall, ''''),
+        purchased_date)', partition || '_natural_key', partition);
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION create_ap_transactions_partitions(first TIMESTAMP WITH TIME ZONE,
+    last TIMESTAMP WITH TIME ZONE) RETURNS VOID AS $$
+DECLARE
+    month TIMESTAMP;
+    partition TEXT;
+BEGIN
+    IF first IS NULL OR last IS NULL THEN
+        RETURN;
+    END IF;
+
+    FOR month IN SELECT generate_series(
+        date_trunc('month', first AT TIME ZONE 'America/New_York'),
+        date_trunc('month', last AT TIME ZONE 'America/New_York'),
+        interval '1 month')
+    LOOP
+        partition := 'ap_transactions_' || to_char(month, 'YYYY_MM');
+        IF to_regclass(partition) IS NULL THEN
+            EXECUTE format('CREATE TABLE %I PARTITION OF ap_transactions FOR VALUES FROM (%L) TO (%L)',
+                partition, month AT TIME ZONE 'America/New_York',
+                (month + interval '1 month') AT TIME ZONE 'America/New_York');
+            PERFORM create_ap_transactions_natural_key(partition);
+        END IF;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- catches anything loaded without create_ap_transactions_partitions first;
+-- it has to stay empty for a month's partition to be created later
+CREATE TABLE ap_transactions_default PARTITION OF ap_transactions DEFAULT;
+SELECT create_ap_transactions_natural_key('ap_transactions_default');
+
+SELECT create_ap_transactions_partitions(min(purchased_date), max(purchased_date))
+    FROM ap_transactions_unpartitioned;
+INSERT INTO ap_transactions SELECT * FROM ap_transactions_unpartitioned;
+DROP TABLE ap_transactions_unpartitioned;
+
+CREATE INDEX ap_transactions_stall_purchased ON ap_transactions (stall, purchased_date);
+CREATE INDEX ap_transactions_parking_day_purchased ON ap_transactions (parking_day, purchased_date);
+CREATE INDEX ap_transactions_times_brin ON ap_transactions USING brin (purchased_date, expiry_date);
+
+ANALYZE ap_transactions;
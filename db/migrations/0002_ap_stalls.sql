@@ -0,0 +1,18 @@
+-- every stall the importer has seen, kept up to date batch by batch
+-- (see ap_stalls.py) so the API can count stalls without scanning
+-- ap_transactions
+CREATE TABLE IF NOT EXISTS ap_stalls (
+    stall VARCHAR(50) PRIMARY KEY,
+    zone VARCHAR(50),
+    first_seen TIMESTAMP WITH TIME ZONE NOT NULL,
+    last_seen TIMESTAMP WITH TIME ZONE NOT NULL
+  );
+
+-- the zone of each stall's latest purchase, as ap_stalls.record_sql keeps it
+INSERT INTO ap_stalls (stall, zone, first_seen, last_seen)
+    SELECT stall,
+    (array_agg(zone ORDER BY purchased_date DESC NULLS LAST) FILTER (WHERE zone IS NOT NULL))[1],
+    min(purchased_date), max(purchased_date)
+    FROM ap_transactions WHERE stall IS NOT NULL
+    GROUP BY stall
+    ON CONFLICT (stall) DO NOTHING;
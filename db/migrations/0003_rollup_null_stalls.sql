@@ -0,0 +1,4 @@
+-- ap_hourly_rollup now keeps transactions without a stall under '' (see
+-- ap_rollup.py). Forgetting the watermark makes the next import rebuild every
+-- hour for every stall; the existing rows are served until it replaces them
+DELETE FROM ap_hourly_rollup_watermark;
@@ -6,3 +6,7 @@ DB_HOST = 'postgresql://pavement@localhost/pavement'
 SQLALCHEMY_DATABASE_URI = 'postgresql://pavement@localhost/pavement'
 SQLALCHEMY_TRACK_MODIFICATIONS = False
 JSONIFY_PRETTYPRINT_REGULAR = False
+USE_HOURLY_ROLLUP = True
+CACHE_BACKEND = 'memory'
+CACHE_MAX_ENTRIES = 256
+METRICS_ENABLED = True
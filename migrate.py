@@ -0,0 +1,147 @@
+#!/usr/bin/env python3
+import argparse, config, glob, os, re, psycopg2
+from datetime import timedelta, timezone
+from dateutil import parser
+
+basedir = os.path.abspath(os.path.dirname(__file__))
+
+# the CREATE ... IF NOT EXISTS files every database starts from, applied as
+# version 0000 so the numbered migrations always have something to change
+base_files = ['ap_transactions.sql', 'import_manifest.sql', 'ap_hourly_rollup.sql',
+    'ap_data_version.sql']
+base_version = '0000'
+
+migrations_sql = '''CREATE TABLE IF NOT EXISTS schema_migrations (
+        version VARCHAR(20) PRIMARY KEY,
+        name VARCHAR(200) NOT NULL,
+        applied_at TIMESTAMP WITH TIME ZONE NOT NULL DEFAULT now()
+      )'''
+
+# the shapes get_filters in api/api.py produces for each endpoint
+plan_queries = [
+    ('occupancy', '''SELECT stall, purchased_date, expiry_date FROM ap_transactions
+        WHERE %(start)s < expiry_date AND %(end)s > purchased_date
+            AND %(earliest)s < purchased_date'''),
+    ('occupancy by stall', '''SELECT stall, purchased_date, expiry_date FROM ap_transactions
+        WHERE %(start)s < expiry_date AND %(end)s > purchased_date
+            AND %(earliest)s < purchased_date AND stall = ANY(%(stalls)s)'''),
+    ('revenue and time', '''SELECT stall, purchased_date, revenue FROM ap_transactions
+        WHERE %(start)s <= purchased_date AND %(end)s > purchased_date'''),
+    ('revenue and time by day', '''SELECT stall, purchased_date, revenue FROM ap_transactions
+        WHERE %(start)s <= purchased_date AND %(end)s > purchased_date
+            AND parking_day = %(day)s''')
+]
+
+def main():
+    args = get_args()
+    db = psycopg2.connect(
+        host=config.Db.host,
+        user=config.Db.user,
+        password=config.Db.pw,
+        dbname=config.Db.name)
+
+    if args.check_plans:
+        check_plans(db, args.check_plans[0], args.check_plans[1])
+    else:
+        migrate(db, args.dry_run)
+
+def get_args():
+    arg_parser = argparse.ArgumentParser(description='Apply schema migrations from db/migrations.')
+    arg_parser.add_argument('--dry-run', action='store_true',
+        help='list pending migrations without applying them')
+    arg_parser.add_argument('--check-plans', nargs=2, metavar=('START', 'END'),
+        help='EXPLAIN each endpoint query over an ISO 8601 range instead of migrating')
+    return arg_parser.parse_args()
+
+def get_migrations():
+    # (version, name, [paths]) in the order they apply
+    migrations = [(base_version, 'base', [os.path.join(basedir, 'db', file) for file in base_files])]
+    for path in sorted(glob.glob(os.path.join(basedir, 'db', 'migrations', '*.sql'))):
+        match = re.match(r'(\d+)_(.+)\.sql$', os.path.basename(path))
+        if match:
+            migrations.append((match.group(1), match.group(2), [path]))
+    return migrations
+
+def get_pending(db):
+    # migrations not yet applied to db, in the order they apply
+    with db.cursor() as cursor:
+        cursor.execute(migrations_sql)
+        cursor.execute('SELECT version FROM schema_migrations')
+        applied = set(version for version, in cursor.fetchall())
+    db.commit()
+
+    return [migration for migration in get_migrations() if migration[0] not in applied]
+
+def migrate(db, dry_run = False):
+    pending = get_pending(db)
+    if not pending:
+        print('Schema is up to date\n')
+        return
+
+    for version, name, paths in pending:
+        if dry_run:
+            print('Pending ' + version + ' ' + name)
+            continue
+
+        print('Applying ' + version + ' ' + name + '...')
+        try:
+            # each migration commits or rolls back as a whole
+            with db.cursor() as cursor:
+                for path in paths:
+                    with open(path) as file:
+                        cursor.execute(file.read())
+                cursor.execute('INSERT INTO schema_migrations (version, name) VALUES (%s, %s)',
+                    (version, name))
+            db.commit()
+        except psycopg2.Error as e:
+            db.rollback()
+            print('Migration ' + version + ' ' + name + ' failed: ' + str(e).strip() + '\n')
+            raise SystemExit(1)
+
+    if not dry_run:
+        print('Applied ' + str(len(pending)) + ' migrations\n')
+
+def check_plans(db, start, end):
+    # each endpoint query should only touch the partitions its range covers
+    # and reach them through an index rather than a sequential scan
+    start = parse_datetime(start)
+    end = parse_datetime(end)
+    params = {
+        'start': start,
+        'end': end,
+        'earliest': start - timedelta(days=getattr(config.Config, 'MAX_TRANSACTION_DAYS', 31)),
+        'stalls': [],
+        'day': 0
+    }
+
+    with db.cursor() as cursor:
+        cursor.execute('''SELECT count(*) FROM pg_inherits
+            WHERE inhparent = 'ap_transactions'::regclass''')
+        partitions = cursor.fetchone()[0]
+
+        with db.cursor() as stall_cursor:
+            stall_cursor.execute('SELECT stall FROM ap_transactions WHERE stall IS NOT NULL LIMIT 10')
+            params['stalls'] = [stall for stall, in stall_cursor.fetchall()]
+
+        for name, sql in plan_queries:
+            cursor.execute('EXPLAIN ' + sql, params)
+            plan = [line for line, in cursor.fetchall()]
+            # table scans only; bitmap index scans name the index instead
+            scanned = set(re.findall(r'(?:Seq Scan|Heap Scan|Scan using \w+) on (ap_transactions_\w+)',
+                '\n'.join(plan)))
+            sequential = [line.strip() for line in plan if 'Seq Scan' in line]
+
+            print(name + ': ' + str(len(scanned)) + ' of ' + str(partitions) + ' partitions'
+                + (', sequential scans:' if sequential else ', indexed'))
+            for line in sequential:
+                print('    ' + line)
+
+def parse_datetime(val):
+    # ISO 8601 as the API takes it; times without an offset are UTC
+    parsed = parser.isoparse(val)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
+
+if __name__ == '__main__':
+    main()